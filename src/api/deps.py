@@ -0,0 +1,10 @@
+"""
+FastAPI dependencies shared by the API routers
+"""
+from fastapi import Request
+
+from services.vm_manager import VMManager
+
+def get_vm_manager(request: Request) -> VMManager:
+    """Dependency returning the VMManager created in the app lifespan"""
+    return request.app.state.vm_manager
@@ -1,104 +1,104 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
-from typing import List, Dict, Any, Optional
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Query
+from fastapi.responses import ORJSONResponse
+from typing import List, Dict, Any
+import functools
 import logging
+import uuid
 
-from core.db import get_db
-from services.vm_manager import VMManager
+from services.vm_manager import LIST_PAGE_MAX, LIST_PAGE_SIZE, VMManager
+from api.deps import get_vm_manager
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-vm_manager = VMManager()
+
+def http_errors(action: str):
+    """Log unexpected errors from a route and turn them into a 500 response"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await fn(*args, **kwargs)
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.error(f"Error {action}: {e}")
+                raise HTTPException(status_code=500, detail=str(e))
+        return wrapper
+    return decorator
 
 @router.post("/golden-images", response_model=Dict[str, str])
+@http_errors("creating golden image")
 async def create_golden_image(
     background_tasks: BackgroundTasks,
-    vm_type: str = "11"
+    vm_type: str = "11",
+    vm_manager: VMManager = Depends(get_vm_manager)
 ):
     """Create a new golden image"""
-    try:
-        golden_id = await vm_manager.create_golden_image(vm_type)
-        
-        # In a real implementation, you'd monitor the installation and automatically
-        # mark it ready when Windows installation completes
-        # For now, this is a manual process
-        
-        return {
-            "golden_id": golden_id,
-            "status": "creating",
-            "message": "Golden image creation started. Monitor installation and call /golden-images/{golden_id}/ready when complete."
-        }
-    except Exception as e:
-        logger.error(f"Error creating golden image: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    golden_id = await vm_manager.create_golden_image(vm_type)
+    
+    # In a real implementation, you'd monitor the installation and automatically
+    # mark it ready when Windows installation completes
+    # For now, this is a manual process
+    
+    return {
+        "golden_id": golden_id,
+        "status": "creating",
+        "message": "Golden image creation started. Monitor installation and call /golden-images/{golden_id}/ready when complete."
+    }
 
 @router.post("/golden-images/{golden_id}/ready")
-async def mark_golden_image_ready(golden_id: str):
+@http_errors("marking golden image ready")
+async def mark_golden_image_ready(golden_id: uuid.UUID, vm_manager: VMManager = Depends(get_vm_manager)):
     """Mark a golden image as ready for use"""
-    try:
-        await vm_manager.mark_golden_image_ready(golden_id)
-        return {"status": "success", "message": "Golden image marked as ready"}
-    except Exception as e:
-        logger.error(f"Error marking golden image ready: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    await vm_manager.mark_golden_image_ready(str(golden_id))
+    return {"status": "success", "message": "Golden image marked as ready"}
 
 @router.post("/instances", response_model=Dict[str, Any])
-async def create_vm_instance(vm_type: str = "win11"):
+@http_errors("creating VM instance")
+async def create_vm_instance(vm_type: str = "win11", vm_manager: VMManager = Depends(get_vm_manager)):
     """Create a new VM instance"""
-    try:
-        instance_id = await vm_manager.create_vm_instance(vm_type)
-        return {"instance_id": instance_id, "status": "creating"}
-    except Exception as e:
-        logger.error(f"Error creating VM instance: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    instance_id = await vm_manager.create_vm_instance(vm_type)
+    return {"instance_id": instance_id, "status": "creating"}
 
 @router.post("/assign", response_model=Dict[str, Any])
-async def assign_vm(assigned_to: str):
+@http_errors("assigning VM")
+async def assign_vm(assigned_to: str, vm_manager: VMManager = Depends(get_vm_manager)):
     """Assign a VM to a user/task from hot spare pool"""
-    try:
-        vm_info = await vm_manager.assign_vm(assigned_to)
-        if not vm_info:
-            raise HTTPException(status_code=503, detail="No VMs available")
-        return vm_info
-    except Exception as e:
-        logger.error(f"Error assigning VM: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    vm_info = await vm_manager.assign_vm(assigned_to)
+    if not vm_info:
+        # The refiller has been asked for a spare; one is ready once its Windows boot reports in
+        raise HTTPException(status_code=503, detail="No VMs available", headers={"Retry-After": "30"})
+    return vm_info
 
 @router.post("/instances/{instance_id}/release")
-async def release_vm(instance_id: str):
+@http_errors("releasing VM")
+async def release_vm(instance_id: uuid.UUID, vm_manager: VMManager = Depends(get_vm_manager)):
     """Release a VM by completely destroying it (for security - no data persistence)"""
-    try:
-        await vm_manager.release_vm(instance_id)
-        return {"status": "success", "message": "VM destroyed for security (hot spares will be replenished)"}
-    except Exception as e:
-        logger.error(f"Error releasing VM: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    await vm_manager.release_vm(str(instance_id))
+    return {"status": "success", "message": "VM destroyed for security (hot spares will be replenished)"}
 
 @router.delete("/instances/{instance_id}")
-async def destroy_vm(instance_id: str):
+@http_errors("destroying VM")
+async def destroy_vm(instance_id: uuid.UUID, vm_manager: VMManager = Depends(get_vm_manager)):
     """Completely destroy a VM instance"""
-    try:
-        await vm_manager.destroy_vm(instance_id)
-        return {"status": "success", "message": "VM destroyed"}
-    except Exception as e:
-        logger.error(f"Error destroying VM: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    await vm_manager.destroy_vm(str(instance_id))
+    return {"status": "success", "message": "VM destroyed"}
 
 @router.get("/instances", response_model=List[Dict[str, Any]])
-async def list_vms():
-    """List all VM instances"""
-    try:
-        return await vm_manager.list_vms()
-    except Exception as e:
-        logger.error(f"Error listing VMs: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@http_errors("listing VMs")
+async def list_vms(
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    vm_manager: VMManager = Depends(get_vm_manager)
+):
+    """List VM instances, newest first"""
+    # orjson encodes the UUIDs and datetimes directly; skip response_model re-validation
+    return ORJSONResponse(await vm_manager.list_vms(limit, offset))
 
 @router.post("/hot-spares/ensure")
-async def ensure_hot_spares():
+@http_errors("ensuring hot spares")
+async def ensure_hot_spares(vm_manager: VMManager = Depends(get_vm_manager)):
     """Manually trigger hot spare replenishment"""
-    try:
-        await vm_manager.ensure_hot_spares()
-        return {"status": "success", "message": "Hot spare replenishment triggered"}
-    except Exception as e:
-        logger.error(f"Error ensuring hot spares: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    # Runs on the background refiller, so it coalesces with any replenishment already due
+    vm_manager.request_hot_spares()
+    return {"status": "success", "message": "Hot spare replenishment triggered"}
@@ -1,23 +1,46 @@
 """
 Webhook endpoints for container lifecycle management
+
+Handlers that only do blocking work (MAC lookups) are plain `def` so FastAPI runs
+them on its threadpool (anyio default: 40 threads). The ready handler stays
+`async def` because it awaits the readiness queue and VMManager coroutines; its
+blocking lookup is pushed to a thread explicitly. Database access is async.
 """
+import asyncio
 import logging
-from pathlib import Path
-from typing import Optional
-from fastapi import APIRouter, HTTPException, Header, Response, status
-from sqlalchemy.orm import Session
+import uuid
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Header, Response, status
+from sqlalchemy import update
 
 from core.config import settings
-from core.db import SessionLocal, GoldenImage, VMInstance
+from core.db import SessionLocal, VMInstance, VMStatus
+from core.mac_index import mac_index
 from services.vm_manager import VMManager
+from api.deps import get_vm_manager
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# VM instance readiness events are drained in batches by process_ready_events
+READY_BATCH_SIZE = 64
+READY_BATCH_WAIT = 0.5
+# The reporter stops retrying once answered 202, so failed batches are retried here instead,
+# up to READY_MAX_ATTEMPTS with the delay doubling from READY_RETRY_DELAY seconds
+READY_MAX_ATTEMPTS = 5
+READY_RETRY_DELAY = 1.0
+_ready_queue: "asyncio.Queue[Tuple[uuid.UUID, int]]" = asyncio.Queue()
+
+# Bounds concurrent ready-webhook lookups so a boot storm cannot exhaust the thread pool
+_lookup_slots = asyncio.Semaphore(settings.WEBHOOK_CONCURRENCY)
+
 @router.post("/ready/{vm_type}")
 async def container_ready_webhook(
     vm_type: str,
-    mac_address: Optional[str] = Header(None, alias="MAC-Address")
+    response: Response,
+    background_tasks: BackgroundTasks,
+    mac_address: Optional[str] = Header(None, alias="MAC-Address"),
+    vm_manager: VMManager = Depends(get_vm_manager)
 ):
     """
     Webhook endpoint for containers to report they are ready.
@@ -39,7 +62,8 @@ async def container_ready_webhook(
         )
     
     # Find the container by MAC address
-    container_info = await find_container_by_mac(vm_type, mac_address)
+    async with _lookup_slots:
+        container_info = await asyncio.to_thread(find_container_by_mac, vm_type, mac_address)
     
     if not container_info:
         logger.error(f"No container found for MAC {mac_address}")
@@ -48,60 +72,36 @@ async def container_ready_webhook(
             detail=f"No container found for MAC address {mac_address}"
         )
     
-    vm_manager = VMManager()
-    
     if container_info["type"] == "golden_image":
-        # Handle golden image completion
-        logger.info(f"Processing golden image completion for {container_info['id']}")
-        try:
-            await vm_manager.mark_golden_image_ready(container_info["id"])
-            # Automatically create hot spares now that template is ready
-            await vm_manager.ensure_hot_spares()
-            return {
-                "status": "processed",
-                "type": "golden_image",
-                "message": f"Golden image {container_info['id']} marked as ready and hot spares initiated"
-            }
-        except Exception as e:
-            logger.error(f"Error processing golden image webhook: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error processing golden image: {str(e)}"
-            )
+        # Golden image completion stops the reporting container, so answer first
+        logger.info(f"Accepted golden image completion for {container_info['id']}")
+        background_tasks.add_task(complete_golden_image, vm_manager, container_info["id"])
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "status": "accepted",
+            "type": "golden_image",
+            "message": f"Golden image {container_info['id']} will be marked as ready and hot spares initiated"
+        }
     
     elif container_info["type"] == "vm_instance":
-        # Handle VM instance readiness
-        logger.info(f"Processing VM instance readiness for {container_info['id']}")
+        # Queue VM instance readiness; the batch worker marks it ready. Ids are parsed here so
+        # one bad id can never fail the batch it would have joined
         try:
-            # Update VM status to ready
-            db = SessionLocal()
-            try:
-                vm_instance = db.query(VMInstance).filter(VMInstance.id == container_info["id"]).first()
-                if vm_instance and vm_instance.status == "starting":
-                    vm_instance.status = "ready"
-                    db.commit()
-                    logger.info(f"VM instance {container_info['id']} marked as ready")
-                    
-                    return {
-                        "status": "processed", 
-                        "type": "vm_instance",
-                        "message": f"VM instance {container_info['id']} marked as ready"
-                    }
-                else:
-                    logger.warning(f"VM instance {container_info['id']} not found or not in starting state")
-                    return {
-                        "status": "ignored",
-                        "message": "VM instance not in expected state"
-                    }
-            finally:
-                db.close()
-                
-        except Exception as e:
-            logger.error(f"Error processing VM instance webhook: {e}")
+            instance_id = uuid.UUID(container_info["id"])
+        except ValueError:
+            logger.warning(f"Dropping readiness for MAC {mac_address}: invalid instance id {container_info['id']}")
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error processing VM instance: {str(e)}"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Container is not a valid VM instance"
             )
+        logger.info(f"Queueing VM instance readiness for {instance_id}")
+        await _ready_queue.put((instance_id, 0))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "status": "accepted",
+            "type": "vm_instance",
+            "message": f"VM instance {container_info['id']} queued to be marked as ready"
+        }
     
     else:
         logger.error(f"Unknown container type: {container_info['type']}")
@@ -111,7 +111,7 @@ async def container_ready_webhook(
         )
 
 @router.get("/status/{vm_type}")
-async def container_status_check(
+def container_status_check(
     vm_type: str,
     mac_address: Optional[str] = Header(None, alias="MAC-Address")
 ):
@@ -134,7 +134,7 @@ async def container_status_check(
         )
     
     # Check if container is registered
-    container_info = await find_container_by_mac(vm_type, mac_address)
+    container_info = find_container_by_mac(vm_type, mac_address)
     
     if container_info:
         return {
@@ -149,9 +149,71 @@ async def container_status_check(
         detail="Container not registered"
     )
 
-async def find_container_by_mac(vm_type: str, mac_address: str) -> Optional[dict]:
+async def complete_golden_image(vm_manager: VMManager, golden_id: str):
+    """Turn a finished golden image into the template, then create hot spares from it"""
+    logger.info(f"Processing golden image completion for {golden_id}")
+    try:
+        await vm_manager.mark_golden_image_ready(golden_id)
+    except Exception as e:
+        logger.error(f"Error processing golden image webhook: {e}")
+        return
+    
+    # Automatically create hot spares now that template is ready
+    vm_manager.request_hot_spares()
+
+async def process_ready_events():
+    """Drain queued VM readiness events and mark each batch ready with a single UPDATE"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _ready_queue.get()]
+        deadline = loop.time() + READY_BATCH_WAIT
+        while len(batch) < READY_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_ready_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        try:
+            await mark_instances_ready([instance_id for instance_id, _ in batch])
+        except Exception as e:
+            logger.error(f"Error processing VM instance readiness batch: {e}")
+            retry_ready_events(batch)
+
+def retry_ready_events(batch: List[Tuple[uuid.UUID, int]]):
+    """Requeue a failed batch's events after a backoff, giving up after READY_MAX_ATTEMPTS"""
+    loop = asyncio.get_running_loop()
+    for instance_id, attempt in batch:
+        if attempt + 1 >= READY_MAX_ATTEMPTS:
+            logger.error(f"Giving up marking VM instance {instance_id} ready after {READY_MAX_ATTEMPTS} attempts")
+            continue
+        loop.call_later(READY_RETRY_DELAY * 2 ** attempt, _ready_queue.put_nowait, (instance_id, attempt + 1))
+
+async def mark_instances_ready(instance_ids: List[uuid.UUID]):
+    """Mark the given VM instances ready if they are still starting"""
+    async with SessionLocal() as db:
+        # Single conditional UPDATE: no SELECT first and no window between check and write
+        result = await db.execute(
+            update(VMInstance)
+            .where(VMInstance.id.in_(instance_ids), VMInstance.status == VMStatus.STARTING)
+            .values(status=VMStatus.READY)
+            .returning(VMInstance.id)
+        )
+        updated = set(result.scalars().all())
+        await db.commit()
+    
+    for instance_id in instance_ids:
+        if instance_id in updated:
+            logger.info(f"VM instance {instance_id} marked as ready")
+        else:
+            logger.warning(f"VM instance {instance_id} not found or not in starting state")
+
+def find_container_by_mac(vm_type: str, mac_address: str) -> Optional[dict]:
     """
-    Find container information by MAC address using auto-generated .mac files from qemu/kvm
+    Find container information by MAC address using the in-memory MAC index.
+    Index misses touch the filesystem, so async callers run this in a worker thread.
     
     Args:
         vm_type: The VM type to search in
@@ -161,51 +223,13 @@ async def find_container_by_mac(vm_type: str, mac_address: str) -> Optional[dict
         Optional[dict]: Container info with id and type, or None if not found
     """
     try:
-        mac_address = mac_address.strip().upper().replace('-', ':')
-        
-        # Check golden images first
-        golden_path = Path(settings.GOLDEN_IMAGES_PATH)
-        for golden_dir in golden_path.glob("*"):
-            if not golden_dir.is_dir() or golden_dir.name.endswith("_template"):
-                continue
-                
-            for mac_file in golden_dir.glob("*.mac"):
-                if mac_file.exists():
-                    try:
-                        with open(mac_file, "r") as f:
-                            stored_mac = f.read().strip().upper().replace('-', ':')
-                        
-                        if stored_mac == mac_address:
-                            golden_id = golden_dir.name
-                            logger.info(f"Found golden image {golden_id} for MAC {mac_address}")
-                            return {"id": golden_id, "type": "golden_image"}
-                    except Exception as e:
-                        logger.warning(f"Error reading MAC file {mac_file}: {e}")
-                        continue
-        
-        # Check VM instances
-        instances_path = Path(settings.INSTANCES_PATH)
-        for instance_dir in instances_path.glob("*"):
-            if not instance_dir.is_dir():
-                continue
-                
-            for mac_file in instance_dir.glob("*.mac"):
-                if mac_file.exists():
-                    try:
-                        with open(mac_file, "r") as f:
-                            stored_mac = f.read().strip().upper().replace('-', ':')
-                        
-                        if stored_mac == mac_address:
-                            instance_id = instance_dir.name
-                            logger.info(f"Found VM instance {instance_id} for MAC {mac_address}")
-                            return {"id": instance_id, "type": "vm_instance"}
-                    except Exception as e:
-                        logger.warning(f"Error reading MAC file {mac_file}: {e}")
-                        continue
-        
-        logger.info(f"No container found for MAC {mac_address}")
-        return None
+        container_info = mac_index.lookup(mac_address)
+        if container_info:
+            logger.info(f"Found {container_info['type']} {container_info['id']} for MAC {mac_address}")
+        else:
+            logger.info(f"No container found for MAC {mac_address}")
+        return container_info
         
     except Exception as e:
         logger.error(f"Error finding container by MAC: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -1,24 +1,39 @@
 import requests
+from requests.adapters import HTTPAdapter
 import time
-import socket
+import random
 import subprocess
 import logging
-import os
-from pathlib import Path
+import uuid
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuration
 WEBHOOK_HOST = "{{VAPIORC_HOST_IP}}"
 WEBHOOK_PORT = "8000"
 VM_TYPE = "11"
-MAX_RETRIES = 30
-RETRY_DELAY = 10
+MAX_RETRIES = 8
+# Exponential backoff with jitter keeps VMs that boot together from retrying in lockstep
+RETRY_BASE_DELAY = 1.5
+RETRY_MAX_DELAY = 60
+RETRY_DEADLINE = 300
+# Separate connect/read timeouts so an unreachable host fails fast
+REQUEST_TIMEOUT = (3, 7)
+
+# One session for all attempts so retries reuse the pooled connection
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
 
 def get_mac_address():
     """Get the MAC address of the primary network interface"""
+    # uuid.getnode() reads the adapter address in-process; it sets the multicast
+    # bit when it had to fall back to a random number
+    node = uuid.getnode()
+    if not (node >> 40) & 1:
+        mac = ':'.join(f'{(node >> shift) & 0xff:02X}' for shift in range(40, -1, -8))
+        logger.info("Detected MAC address: %s", mac)
+        return mac
+    
     try:
         output = subprocess.check_output("getmac", shell=True).decode('utf-8')
         # Parse the output and return the first valid MAC address
@@ -26,10 +41,10 @@ def get_mac_address():
             if '-' in line:  # MAC addresses contain hyphens
                 mac = line.split()[0]  # MAC address is usually the first element
                 mac = mac.replace('-', ':')  # Replace '-' with ':'
-                logger.info(f"Detected MAC address: {mac}")
+                logger.info("Detected MAC address: %s", mac)
                 return mac
     except Exception as e:
-        logger.error(f"Error getting MAC address: {e}")
+        logger.error("Error getting MAC address: %s", e)
     return None
 
 def report_readiness():
@@ -42,28 +57,35 @@ def report_readiness():
     webhook_url = f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}/webhook/ready/{VM_TYPE}"
     headers = {"MAC-Address": mac_address}
 
+    deadline = time.monotonic() + RETRY_DEADLINE
     for attempt in range(MAX_RETRIES):
         try:
-            logger.info(f"Reporting readiness to {webhook_url} (attempt {attempt + 1}/{MAX_RETRIES})")
-            response = requests.post(webhook_url, headers=headers, timeout=10)
+            logger.info("Reporting readiness to %s (attempt %d/%d)", webhook_url, attempt + 1, MAX_RETRIES)
+            response = _session.post(webhook_url, headers=headers, timeout=REQUEST_TIMEOUT)
             
-            if response.status_code == 200:
+            # 202 means the orchestrator queued the readiness event
+            if response.status_code in (200, 202):
                 logger.info("Successfully reported readiness")
                 return True
             else:
-                logger.warning(f"Webhook returned status {response.status_code}: {response.text}")
+                logger.warning("Webhook returned status %d: %s", response.status_code, response.text)
                 
         except requests.exceptions.RequestException as e:
-            logger.warning(f"Failed to reach webhook: {e}")
+            logger.warning("Failed to reach webhook: %s", e)
             
         if attempt + 1 != MAX_RETRIES:
-            logger.info(f"Waiting {RETRY_DELAY} seconds before retry...")
-            time.sleep(RETRY_DELAY)
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.5)
+            if time.monotonic() + delay > deadline:
+                break
+            logger.info("Waiting %.1f seconds before retry...", delay)
+            time.sleep(delay)
     
-    logger.error(f"Failed to report readiness after {MAX_RETRIES} attempts")
+    logger.error("Failed to report readiness after %d attempts", attempt + 1)
     return False
 
 if __name__ == "__main__":
+    # Configure logging only when run as the reporter script
+    logging.basicConfig(level=logging.INFO)
     logger.info("Starting vapiorc readiness reporter")
     
     # Wait a bit for network to be fully ready
@@ -1,6 +1,21 @@
+import logging
 import os
+import re
+from functools import cached_property
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
+
+__all__ = ["settings"]
+
+logger = logging.getLogger(__name__)
+
+# Guest assets that carry the webhook host, relative to CONTAINER_ASSETS_DIR
+_GUEST_ASSETS = ("install.bat", "vapiorc_reporter.py")
+
+# The guest assets are ASCII, so they are matched and rewritten as bytes without a codec pass
+_PLACEHOLDER = b"{{VAPIORC_HOST_IP}}"
+# Matches the configured host line in the guest assets
+_IP_PATTERN = re.compile(rb'WEBHOOK_HOST = "[^"]*"')
 
 class Settings:
     """Simple configuration management for vapiorc"""
@@ -8,119 +23,250 @@ class Settings:
     PROJECT_NAME: str = "vapiorc - VM Orchestrator"
     VERSION: str = "0.1.0"
     
+    CONTAINER_ASSETS_DIR: str = "/app/assets"  # Mounted via docker-compose
+    VM_TYPE: str = "11"  # Fixed to Windows 11
+    
+    # Environment-derived values are built on first access and cached on the instance
+    
     # Database
-    DATABASE_URL: str = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/vapiorcdb")
-    REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379/0")
+    @cached_property
+    def DATABASE_URL(self) -> str:
+        return os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/vapiorcdb")
+    
+    @cached_property
+    def REDIS_URL(self) -> str:
+        return os.getenv("REDIS_URL", "redis://redis:6379/0")
+    
+    # Sized for bursts of readiness webhooks while the hot spare pool boots
+    @cached_property
+    def DB_POOL_SIZE(self) -> int:
+        return int(os.getenv("VAPIORC_DB_POOL_SIZE", "20"))
+    
+    @cached_property
+    def DB_MAX_OVERFLOW(self) -> int:
+        return int(os.getenv("VAPIORC_DB_MAX_OVERFLOW", "20"))
+    
+    @cached_property
+    def DB_POOL_TIMEOUT(self) -> int:
+        return int(os.getenv("VAPIORC_DB_POOL_TIMEOUT", "10"))
+    
+    # Connections opened at boot so the first requests don't pay for connecting; 0 disables
+    @cached_property
+    def DB_POOL_WARM(self) -> int:
+        return int(os.getenv("VAPIORC_DB_POOL_WARM", "4"))
+    
+    # Create missing tables and indexes at boot; set to 0 once deployments run scripts/migrate.py
+    @cached_property
+    def AUTOMIGRATE(self) -> bool:
+        return os.getenv("VAPIORC_AUTOMIGRATE", "1") == "1"
     
     # Host paths (absolute paths on the Docker host)
-    HOST_BASE_DIR: str = os.getenv("VAPIORC_HOST_BASE_DIR", "/home/cayub/code/vapiorc")
-    HOST_DATA_DIR: str = os.getenv("VAPIORC_HOST_DATA_DIR", f"{HOST_BASE_DIR}/app_data")
-    HOST_GOLDEN_IMAGES_PATH: str = f"{HOST_DATA_DIR}/golden_images"
-    HOST_INSTANCES_PATH: str = f"{HOST_DATA_DIR}/instances"
-    HOST_ASSETS_PATH: str = f"{HOST_BASE_DIR}/src/assets"
+    @cached_property
+    def HOST_BASE_DIR(self) -> str:
+        return os.getenv("VAPIORC_HOST_BASE_DIR", "/home/cayub/code/vapiorc")
+    
+    @cached_property
+    def HOST_DATA_DIR(self) -> str:
+        return os.getenv("VAPIORC_HOST_DATA_DIR", f"{self.HOST_BASE_DIR}/app_data")
+    
+    @cached_property
+    def HOST_GOLDEN_IMAGES_PATH(self) -> str:
+        return f"{self.HOST_DATA_DIR}/golden_images"
+    
+    @cached_property
+    def HOST_INSTANCES_PATH(self) -> str:
+        return f"{self.HOST_DATA_DIR}/instances"
+    
+    @cached_property
+    def HOST_ASSETS_PATH(self) -> str:
+        return f"{self.HOST_BASE_DIR}/src/assets"
     
     # Container paths (internal to vapiorc app container)
-    CONTAINER_DATA_DIR: str = os.getenv("VAPIORC_CONTAINER_DATA_DIR", "/app/data")
-    CONTAINER_ASSETS_DIR: str = "/app/assets"  # Mounted via docker-compose
-    GOLDEN_IMAGES_PATH: str = f"{CONTAINER_DATA_DIR}/golden_images"
-    INSTANCES_PATH: str = f"{CONTAINER_DATA_DIR}/instances"
+    @cached_property
+    def CONTAINER_DATA_DIR(self) -> str:
+        return os.getenv("VAPIORC_CONTAINER_DATA_DIR", "/app/data")
+    
+    @cached_property
+    def GOLDEN_IMAGES_PATH(self) -> str:
+        return f"{self.CONTAINER_DATA_DIR}/golden_images"
+    
+    @cached_property
+    def INSTANCES_PATH(self) -> str:
+        return f"{self.CONTAINER_DATA_DIR}/instances"
     
-    # Docker settings  
-    DOCKER_NETWORK: str = os.getenv("VAPIORC_NETWORK", "vapiorc_vapiorc_network")
+    @cached_property
+    def MAC_LINKS_PATH(self) -> str:
+        return f"{self.CONTAINER_DATA_DIR}/by-mac"
+    
+    # Docker settings
+    @cached_property
+    def DOCKER_NETWORK(self) -> str:
+        return os.getenv("VAPIORC_NETWORK", "vapiorc_vapiorc_network")
     
     # Port management
-    PORT_RANGE_START: int = int(os.getenv("VAPIORC_PORT_START", "8001"))
-    PORT_RANGE_END: int = int(os.getenv("VAPIORC_PORT_END", "8100"))
+    @cached_property
+    def PORT_RANGE_START(self) -> int:
+        return int(os.getenv("VAPIORC_PORT_START", "8001"))
+    
+    @cached_property
+    def PORT_RANGE_END(self) -> int:
+        return int(os.getenv("VAPIORC_PORT_END", "8100"))
+    
+    # Instance disks are qcow2 overlays backed by the template instead of full copies
+    @cached_property
+    def TEMPLATE_OVERLAYS(self) -> bool:
+        return os.getenv("VAPIORC_TEMPLATE_OVERLAYS", "1") == "1"
     
     # Hot spare settings
-    HOT_SPARE_COUNT: int = int(os.getenv("VAPIORC_HOT_SPARES", "1"))
+    @cached_property
+    def HOT_SPARE_COUNT(self) -> int:
+        return int(os.getenv("VAPIORC_HOT_SPARES", "1"))
     
-    # VM Configuration
-    VM_TYPE: str = "11"  # Fixed to Windows 11
+    @cached_property
+    def HOT_SPARE_CONCURRENCY(self) -> int:
+        return int(os.getenv("VAPIORC_HOT_SPARE_CONCURRENCY", "4"))
+    
+    # Webhook settings
+    @cached_property
+    def WEBHOOK_CONCURRENCY(self) -> int:
+        return int(os.getenv("VAPIORC_WEBHOOK_CONCURRENCY", "32"))
     
     # Host networking
-    HOST_IP: str = os.getenv("VAPIORC_HOST_IP", "192.168.2.21")
+    @cached_property
+    def HOST_IP(self) -> str:
+        return os.getenv("VAPIORC_HOST_IP", "192.168.2.21")
     
-    @classmethod
-    def ensure_directories(cls):
+    @cached_property
+    def HOST_IP_BYTES(self) -> bytes:
+        return self.HOST_IP.encode("ascii")
+    
+    def ensure_directories(self):
         """Ensure all required directories exist"""
-        for path in [cls.GOLDEN_IMAGES_PATH, cls.INSTANCES_PATH]:
+        for path in [self.GOLDEN_IMAGES_PATH, self.INSTANCES_PATH, self.MAC_LINKS_PATH]:
             Path(path).mkdir(parents=True, exist_ok=True)
     
-    @classmethod
-    def ensure_install_script_configured(cls):
+    @cached_property
+    def GUEST_ASSET_PATHS(self) -> Tuple[Tuple[Path, str], ...]:
+        # Resolved once; a missing file is reported by the open in _update_file_ip, not a stat here
+        assets_dir = Path(self.CONTAINER_ASSETS_DIR)
+        return tuple((assets_dir / name, name) for name in _GUEST_ASSETS)
+    
+    def ensure_install_script_configured(self):
         """Ensure install.bat and vapiorc_reporter.py have the correct host IP configured"""
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        # Update install.bat
-        install_bat_path = Path(cls.CONTAINER_ASSETS_DIR) / "install.bat"
-        cls._update_file_ip(install_bat_path, "install.bat", logger)
-        
-        # Update vapiorc_reporter.py
-        reporter_py_path = Path(cls.CONTAINER_ASSETS_DIR) / "vapiorc_reporter.py"
-        cls._update_file_ip(reporter_py_path, "vapiorc_reporter.py", logger)
-    
-    @classmethod
-    def _update_file_ip(cls, file_path: Path, file_name: str, logger):
-        """Update a single file with the correct host IP"""
-        import re
-        
+        for file_path, file_name in self.GUEST_ASSET_PATHS:
+            self._update_file_ip(file_path, file_name)
+    
+    def _update_file_ip(self, file_path: Path, file_name: str):
+        """Update a single file with the correct host IP, skipping files unchanged since the last run"""
         logger.info(f"Checking for {file_name} at: {file_path}")
-        if not file_path.exists():
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+        except FileNotFoundError:
             logger.error(f"Could not find {file_name} at {file_path}")
             logger.error("Make sure assets folder is properly mounted in docker-compose.yml")
             return
+        except OSError as e:
+            logger.error(f"Failed to read {file_name}: {e}")
+            return
         
-        # Read the current content
+        # One fstat serves both the stamp check and the read size
         try:
-            content = file_path.read_text(encoding='utf-8')
-            logger.info(f"Successfully read {file_name} content ({len(content)} characters)")
+            file_stat = os.fstat(fd)
+            
+            # The stamp records the mtime and host IP of the last successful pass
+            stamp_path = Path(self.CONTAINER_DATA_DIR) / f".{file_name}.stamp"
+            if self._read_stamp(stamp_path) == f"{file_stat.st_mtime_ns}:{self.HOST_IP}":
+                logger.info(f"{file_name} unchanged since it was configured for {self.HOST_IP}")
+                return
+            
+            content = self._read_fd(fd, file_stat.st_size)
+            logger.info("Successfully read %s content (%d bytes)", file_name, len(content))
         except Exception as e:
             logger.error(f"Failed to read {file_name}: {e}")
             return
+        finally:
+            os.close(fd)
         
+        if self._configure_file_ip(file_path, file_name, content):
+            self._write_stamp(stamp_path, f"{os.stat(file_path).st_mtime_ns}:{self.HOST_IP}")
+    
+    def _configure_file_ip(self, file_path: Path, file_name: str, content: bytes) -> bool:
+        """Rewrite the host IP in a file's content; returns False if the file could not be written"""
         # Check if the content needs updating
-        placeholder = "{{VAPIORC_HOST_IP}}"
+        host_ip = self.HOST_IP_BYTES
+        expected_line = b'WEBHOOK_HOST = "' + host_ip + b'"'
         needs_update = False
         updated_content = content
         
-        if placeholder in content:
-            logger.info(f"Found placeholder {placeholder} in {file_name}, replacing with {cls.HOST_IP}")
-            updated_content = content.replace(placeholder, cls.HOST_IP)
+        # Already-configured files are settled by two substring scans, without the regex
+        if _PLACEHOLDER not in content and expected_line in content:
+            logger.info(f"{file_name} already contains correct IP: {self.HOST_IP}")
+            return True
+        
+        if _PLACEHOLDER in content:
+            logger.info(f"Found placeholder {_PLACEHOLDER.decode()} in {file_name}, replacing with {self.HOST_IP}")
+            # Literal substitution; the regex is only needed when the placeholder is gone
+            updated_content = content.replace(_PLACEHOLDER, host_ip)
+            # Verify in memory rather than re-reading the file after the write
+            if updated_content.count(host_ip) < content.count(_PLACEHOLDER):
+                logger.error(f"Failed to verify {file_name} update")
+                return False
             needs_update = True
         else:
             # Check if there's an old IP that needs to be replaced
             # Look for the pattern WEBHOOK_HOST = "x.x.x.x"
-            ip_pattern = r'WEBHOOK_HOST = "[^"]*"'
-            match = re.search(ip_pattern, content)
+            match = _IP_PATTERN.search(content)
             if match:
                 current_ip = match.group(0)
-                expected_line = f'WEBHOOK_HOST = "{cls.HOST_IP}"'
                 if current_ip != expected_line:
-                    logger.info(f"Found existing IP pattern '{current_ip}' in {file_name}, replacing with '{expected_line}'")
-                    updated_content = re.sub(ip_pattern, expected_line, content)
+                    logger.info(f"Found existing IP pattern '{current_ip.decode()}' in {file_name}, replacing with '{expected_line.decode()}'")
+                    updated_content = _IP_PATTERN.sub(expected_line, content)
                     needs_update = True
                 else:
-                    logger.info(f"{file_name} already contains correct IP: {cls.HOST_IP}")
-                    return
+                    logger.info(f"{file_name} already contains correct IP: {self.HOST_IP}")
+                    return True
             else:
-                logger.warning(f"{file_name} does not contain placeholder or IP pattern. Content preview: {content[:200]}...")
-                return
+                logger.warning(f"{file_name} does not contain placeholder or IP pattern. Content preview: {content[:200].decode('utf-8', 'replace')}...")
+                return True
         
-        if needs_update:
+        if needs_update and updated_content != content:
             try:
-                # Write the updated content back
-                file_path.write_text(updated_content, encoding='utf-8')
-                logger.info(f"Successfully updated {file_name} with host IP: {cls.HOST_IP}")
-                
-                # Verify the change was made
-                verify_content = file_path.read_text(encoding='utf-8')
-                if cls.HOST_IP in verify_content and placeholder not in verify_content:
-                    logger.info(f"Verified that {file_name} was updated correctly")
-                else:
-                    logger.error(f"Failed to verify {file_name} update")
+                # Write the updated content back; write_bytes raises if it fails
+                file_path.write_bytes(updated_content)
+                logger.info(f"Successfully updated {file_name} with host IP: {self.HOST_IP}")
             except Exception as e:
                 logger.error(f"Failed to write updated {file_name}: {e}")
+                return False
+        return True
+    
+    @staticmethod
+    def _read_fd(fd: int, size: int) -> bytes:
+        """Read a file of known size from an open descriptor"""
+        chunks = []
+        while size > 0:
+            chunk = os.read(fd, size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+    
+    @staticmethod
+    def _read_stamp(stamp_path: Path) -> Optional[str]:
+        """Read a configuration stamp, or None if there is none yet"""
+        try:
+            return stamp_path.read_text()
+        except OSError:
+            return None
+    
+    @staticmethod
+    def _write_stamp(stamp_path: Path, stamp: str):
+        """Atomically replace a configuration stamp"""
+        tmp_path = stamp_path.with_name(stamp_path.name + ".tmp")
+        try:
+            tmp_path.write_text(stamp)
+            os.replace(tmp_path, stamp_path)
+        except OSError as e:
+            logger.warning(f"Failed to write {stamp_path}: {e}")
 
 settings = Settings()
\ No newline at end of file
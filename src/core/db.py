@@ -1,57 +1,155 @@
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, Boolean, Text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+import asyncio
+import enum
+import uuid
+from datetime import datetime
+from typing import AsyncGenerator, Optional
+from sqlalchemy import String, Integer, SmallInteger, DateTime, Boolean, Index, Uuid, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.sql import func
-import redis
-from typing import Generator
+import redis.asyncio as aioredis
 import logging
 
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
-Base = declarative_base()
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-redis_client = redis.from_url(settings.REDIS_URL)
+def _async_database_url(url: str) -> str:
+    """Point plain postgresql:// URLs at the asyncpg driver"""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+class Base(DeclarativeBase):
+    pass
+
+engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,  # Drop connections the server closed instead of failing the request
+    pool_recycle=1800,
+    query_cache_size=1200,
+    # The orchestrator's queries are short OLTP lookups where JIT compilation only adds latency
+    connect_args={"server_settings": {"jit": "off"}} if settings.DATABASE_URL.startswith("postgresql") else {}
+)
+# expire_on_commit=False: attribute access after commit would otherwise need an implicit async refresh
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+# Async client so redis round-trips do not block the event loop; callers await its methods
+redis_client = aioredis.from_url(settings.REDIS_URL, max_connections=50, socket_keepalive=True)
+
+class VMStatus(enum.IntEnum):
+    """VM instance lifecycle states, stored as a SmallInteger"""
+    STARTING = 0
+    READY = 1
+    BUSY = 2
+    STOPPING = 3
+    STOPPED = 4
+    FAILED = 5
 
 class GoldenImage(Base):
     __tablename__ = "golden_images"
     
-    id = Column(String, primary_key=True)
-    vm_type = Column(String, nullable=False, default="11")
-    status = Column(String, nullable=False)  # creating, ready, failed
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Uuid is native UUID on Postgres (16 bytes) instead of a 36-character string
+    id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, default=uuid.uuid4)
+    vm_type: Mapped[str] = mapped_column(String, default="11")
+    status: Mapped[str] = mapped_column(String)  # creating, ready, failed
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now())
 
 class VMInstance(Base):
     __tablename__ = "vm_instances"
+    __table_args__ = (
+        # Serves the full hot spare predicate used by counting and assignment; the
+        # readiness webhook filters on status alone, which the leading column serves
+        Index("ix_vm_pool", "status", "is_hot_spare", "assigned_to"),
+    )
     
-    id = Column(String, primary_key=True)
-    container_id = Column(String, unique=True, nullable=True)
-    vm_type = Column(String, nullable=False, default="11")
-    status = Column(String, nullable=False)  # starting, ready, busy, stopping, stopped
-    port = Column(Integer, nullable=True)
-    is_hot_spare = Column(Boolean, default=False)
-    assigned_to = Column(String, nullable=True)  # For tracking assignments
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-
-def get_db() -> Generator[Session, None, None]:
-    db = SessionLocal()
-    try:
+    id: Mapped[uuid.UUID] = mapped_column(Uuid, primary_key=True, default=uuid.uuid4)
+    container_id: Mapped[Optional[str]] = mapped_column(String, unique=True)
+    vm_type: Mapped[str] = mapped_column(String, default="11")
+    status: Mapped[int] = mapped_column(SmallInteger)  # VMStatus
+    port: Mapped[Optional[int]] = mapped_column(Integer)
+    is_hot_spare: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
+    assigned_to: Mapped[Optional[str]] = mapped_column(String, index=True)  # For tracking assignments
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now())
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def get_redis() -> redis.Redis:
+def get_redis() -> aioredis.Redis:
     return redis_client
 
-def init_db():
-    """Initialize database tables"""
+def _create_missing_indexes(connection):
+    # create_all skips tables that already exist, so add indexes introduced since
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+# Primary keys created as strings before the switch to native UUID columns
+_UUID_COLUMNS = (("golden_images", "id"), ("vm_instances", "id"))
+
+async def _column_type(conn, table: str, column: str) -> Optional[str]:
+    return await conn.scalar(
+        text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = :table AND column_name = :column"
+        ),
+        {"table": table, "column": column}
+    )
+
+async def _convert_legacy_columns(conn):
+    """Convert varchar ids to uuid and varchar statuses to VMStatus integers on Postgres; no-op once done"""
+    if conn.dialect.name != "postgresql":
+        return
+    for table, column in _UUID_COLUMNS:
+        if await _column_type(conn, table, column) == "character varying":
+            logger.info(f"Converting {table}.{column} to uuid")
+            await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE uuid USING {column}::uuid"))
+    
+    if await _column_type(conn, "vm_instances", "status") == "character varying":
+        logger.info("Converting vm_instances.status to smallint")
+        cases = " ".join(f"WHEN '{state.name.lower()}' THEN {state.value}" for state in VMStatus)
+        await conn.execute(text(
+            f"ALTER TABLE vm_instances ALTER COLUMN status TYPE smallint "
+            f"USING CASE status {cases} ELSE {VMStatus.FAILED.value} END"
+        ))
+
+async def create_schema():
+    """Bring legacy columns up to date, then create missing tables and indexes"""
+    async with engine.begin() as conn:
+        await _convert_legacy_columns(conn)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+
+async def init_db():
+    """Initialize database tables unless schema management is left to scripts/migrate.py"""
+    if not settings.AUTOMIGRATE:
+        logger.info("VAPIORC_AUTOMIGRATE is off, skipping schema checks")
+        return
     try:
-        Base.metadata.create_all(bind=engine)
+        await create_schema()
         logger.info("Database tables created successfully")
     except Exception as e:
         logger.error(f"Error creating database tables: {e}")
-        raise
\ No newline at end of file
+        raise
+
+async def warm_pool():
+    """Open DB_POOL_WARM pooled connections ahead of the first requests"""
+    count = min(settings.DB_POOL_WARM, settings.DB_POOL_SIZE)
+    if count <= 0:
+        return
+    
+    async def check_out():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    
+    # Held concurrently, so the pool ends up with count idle connections rather than one reused
+    try:
+        await asyncio.gather(*(check_out() for _ in range(count)))
+        logger.info(f"Opened {count} database connections")
+    except Exception as e:
+        logger.warning(f"Could not warm the database pool: {e}")
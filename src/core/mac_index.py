@@ -0,0 +1,191 @@
+"""
+In-memory index of container MAC addresses for webhook lookups
+"""
+import logging
+import os
+import threading
+import time
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Scanned in this order so golden images take precedence over instances, matching the old lookup order
+_SCAN_ROOTS = (
+    (settings.INSTANCES_PATH, "vm_instance"),
+    (settings.GOLDEN_IMAGES_PATH, "golden_image"),
+)
+
+# Lookup misses rescan the data directory at most this often; unknown MACs are otherwise cheap to send
+RESCAN_INTERVAL = 5.0
+
+# Upper-cases hex digits and swaps '-' for ':' in a single pass
+_MAC_XLATE = str.maketrans('abcdef-', 'ABCDEF:')
+
+def normalize_mac(mac_address: str) -> str:
+    """Normalize a MAC address to upper-case, colon-separated form"""
+    return mac_address.strip().translate(_MAC_XLATE)
+
+@lru_cache(maxsize=4096)
+def _read_mac(path: str, mtime_ns: int) -> str:
+    """Read and normalize a .mac file; keyed on mtime so rewritten files are re-read"""
+    with open(path, "r") as f:
+        return normalize_mac(f.read())
+
+class MACIndex:
+    """Process-wide mapping of MAC address to container id and type"""
+
+    def __init__(self):
+        self._by_mac: Dict[str, Tuple[str, str]] = {}
+        self._by_id: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._rescan_lock = threading.Lock()
+        self._last_rescan = float("-inf")
+
+    def register(self, mac_address: str, container_id: str, container_type: str, container_path: Path):
+        """Add or replace the index entry for a container and link by-mac/<MAC> to its directory"""
+        mac_address = normalize_mac(mac_address)
+        self._set_entry(mac_address, container_id, container_type)
+
+        link_path = os.path.join(settings.MAC_LINKS_PATH, mac_address)
+        try:
+            if os.path.lexists(link_path):
+                os.unlink(link_path)
+            os.symlink(str(container_path), link_path)
+        except OSError as e:
+            logger.warning(f"Could not link MAC {mac_address} to {container_path}: {e}")
+
+    def _set_entry(self, mac_address: str, container_id: str, container_type: str):
+        """Point a MAC at a container, dropping any MAC previously recorded for that container"""
+        with self._lock:
+            old_mac = self._by_id.pop(container_id, None)
+            if old_mac is not None:
+                self._by_mac.pop(old_mac, None)
+            self._by_mac[mac_address] = (container_id, container_type)
+            self._by_id[container_id] = mac_address
+
+    def evict(self, container_id: str):
+        """Drop the index entry and by-mac link for a container that no longer exists"""
+        with self._lock:
+            mac_address = self._by_id.pop(container_id, None)
+            if mac_address is not None:
+                self._by_mac.pop(mac_address, None)
+        _read_mac.cache_clear()
+
+        if mac_address is not None:
+            try:
+                os.unlink(os.path.join(settings.MAC_LINKS_PATH, mac_address))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove MAC link for {container_id}: {e}")
+
+    @cached_property
+    def _link_parents(self) -> Dict[Path, str]:
+        """Container type by canonical parent directory, so trailing slashes and symlinked data dirs still match"""
+        return {Path(root).resolve(): container_type for root, container_type in _SCAN_ROOTS}
+
+    def _resolve_link(self, mac_address: str) -> Optional[Tuple[str, str]]:
+        """Resolve by-mac/<MAC> to the container directory it points at"""
+        link_path = os.path.join(settings.MAC_LINKS_PATH, mac_address)
+        try:
+            # A relative link target is relative to the links directory; an absolute one replaces it
+            target = Path(settings.MAC_LINKS_PATH, os.readlink(link_path))
+        except OSError:
+            return None
+
+        container_type = self._link_parents.get(target.parent.resolve())
+        if container_type is None or not target.is_dir():
+            return None
+        return target.name, container_type
+
+    def lookup(self, mac_address: str) -> Optional[dict]:
+        """
+        Find container information by MAC address
+
+        Falls back to the by-mac link written at container creation, then to a
+        rescan of the .mac files for containers created before links existed. The rescan
+        runs at most once per RESCAN_INTERVAL; misses in between return None.
+
+        Args:
+            mac_address: The MAC address to search for
+
+        Returns:
+            Optional[dict]: Container info with id and type, or None if not found
+        """
+        mac_address = normalize_mac(mac_address)
+        entry = self._by_mac.get(mac_address)
+        if entry is None:
+            entry = self._resolve_link(mac_address)
+            if entry is not None:
+                self._set_entry(mac_address, *entry)
+                return {"id": entry[0], "type": entry[1]}
+
+            if not self._rescan_if_due():
+                return None
+            entry = self._by_mac.get(mac_address)
+            if entry is None:
+                return None
+
+        container_id, container_type = entry
+        return {"id": container_id, "type": container_type}
+
+    def _rescan_if_due(self) -> bool:
+        """Rebuild unless a rescan is running or ran within RESCAN_INTERVAL; False if skipped"""
+        if not self._rescan_lock.acquire(blocking=False):
+            return False
+        try:
+            now = time.monotonic()
+            if now - self._last_rescan < RESCAN_INTERVAL:
+                return False
+            self._last_rescan = now
+            self.rebuild()
+            return True
+        finally:
+            self._rescan_lock.release()
+
+    def rebuild(self):
+        """Rebuild the index from the .mac files under the golden image and instance paths"""
+        by_mac: Dict[str, Tuple[str, str]] = {}
+        for root, container_type in _SCAN_ROOTS:
+            # DirEntry caches the file type from getdents, so no per-entry stat is needed
+            try:
+                with os.scandir(root) as containers:
+                    # Dot directories are trees waiting to be deleted, not containers
+                    container_dirs = [
+                        entry for entry in containers
+                        if entry.is_dir(follow_symlinks=False)
+                        and not entry.name.endswith("_template") and not entry.name.startswith(".")
+                    ]
+            except FileNotFoundError:
+                continue
+
+            for container_dir in container_dirs:
+                try:
+                    with os.scandir(container_dir.path) as files:
+                        mac_files = [
+                            entry for entry in files
+                            if entry.name.endswith(".mac") and entry.is_file(follow_symlinks=False)
+                        ]
+                except OSError as e:
+                    logger.warning(f"Error listing {container_dir.path}: {e}")
+                    continue
+
+                for mac_file in mac_files:
+                    try:
+                        stored_mac = _read_mac(mac_file.path, mac_file.stat().st_mtime_ns)
+                    except Exception as e:
+                        logger.warning(f"Error reading MAC file {mac_file.path}: {e}")
+                        continue
+                    by_mac[stored_mac] = (container_dir.name, container_type)
+
+        with self._lock:
+            self._by_mac = by_mac
+            self._by_id = {container_id: mac for mac, (container_id, _) in by_mac.items()}
+
+        logger.info(f"MAC index rebuilt with {len(by_mac)} entries")
+
+mac_index = MACIndex()
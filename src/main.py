@@ -1,25 +1,23 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+import orjson
 import logging
 import asyncio
 
 from api import health, vms, webhook
-from core.db import init_db
+from core.db import engine, init_db, redis_client, warm_pool
 from core.config import settings
+from core.mac_index import mac_index
 from services.vm_manager import VMManager
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-vm_manager = VMManager()
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Initialize database
-    init_db()
-    
+def prepare_filesystem():
+    """Blocking startup disk work, run in a worker thread"""
     # Ensure directories exist
     settings.ensure_directories()
     
@@ -27,10 +25,32 @@ async def lifespan(app: FastAPI):
     logger.info(f"Configuring install.bat with host IP: {settings.HOST_IP}")
     settings.ensure_install_script_configured()
     
-    # Start hot spare management in background
-    asyncio.create_task(vm_manager.ensure_hot_spares())
+    # Index MAC addresses of containers that survived a restart
+    mac_index.rebuild()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize database while the filesystem is prepared off the event loop
+    await asyncio.gather(init_db(), asyncio.to_thread(prepare_filesystem))
+    await warm_pool()
+    
+    # One manager per process so every route shares its hot spare lock
+    app.state.vm_manager = VMManager()
+    
+    # Pre-pull the VM image and start hot spare management in background
+    app.state.hot_spare_task = asyncio.create_task(app.state.vm_manager.start())
+    
+    # Start batching VM readiness webhooks
+    ready_events_task = asyncio.create_task(webhook.process_ready_events())
     
     yield
+    
+    app.state.hot_spare_task.cancel()
+    ready_events_task.cancel()
+    await asyncio.gather(app.state.hot_spare_task, ready_events_task, return_exceptions=True)
+    app.state.vm_manager.close()
+    await redis_client.aclose()
+    await engine.dispose()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -38,7 +58,8 @@ app = FastAPI(
     description="Simple containerized Windows VM orchestrator with hot spares",
     docs_url="/docs",
     redoc_url="/redoc",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -54,19 +75,22 @@ app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(vms.router, prefix="/api/vms", tags=["vms"])
 app.include_router(webhook.router, prefix="/webhook", tags=["webhook"])
 
+# The root document never changes, so it is serialized once at import
+_ROOT_BODY = orjson.dumps({
+    "message": settings.PROJECT_NAME,
+    "version": settings.VERSION,
+    "docs": "/docs",
+    "redoc": "/redoc",
+    "endpoints": {
+        "health": "/health",
+        "vms": "/api/vms",
+        "golden_images": "/api/vms/golden-images",
+        "assign_vm": "/api/vms/assign",
+        "instances": "/api/vms/instances",
+        "webhook": "/webhook"
+    }
+})
+
 @app.get("/", summary="API Root")
 def root():
-    return {
-        "message": settings.PROJECT_NAME,
-        "version": settings.VERSION,
-        "docs": "/docs",
-        "redoc": "/redoc",
-        "endpoints": {
-            "health": "/health",
-            "vms": "/api/vms",
-            "golden_images": "/api/vms/golden-images",
-            "assign_vm": "/api/vms/assign",
-            "instances": "/api/vms/instances",
-            "webhook": "/webhook"
-        }
-    }
+    return Response(content=_ROOT_BODY, media_type="application/json")
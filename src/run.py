@@ -0,0 +1,24 @@
+"""
+Server entrypoint for vapiorc
+
+Runs uvicorn on uvloop with the httptools parser and, unless asked for, without
+the per-request access log.
+"""
+import os
+
+import uvicorn
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        # Hot spare management, the MAC index and the readiness queue are per-process
+        # state, so extra workers would run competing orchestrators. Each worker is a
+        # fresh interpreter, so engines and pools are never shared across a fork.
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        reload=os.getenv("VAPIORC_RELOAD", "0") == "1",
+        access_log=os.getenv("VAPIORC_ACCESS_LOG", "0") == "1",
+    )
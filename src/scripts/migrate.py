@@ -0,0 +1,25 @@
+"""
+One-off schema migration for vapiorc
+
+Run once per deployment from the src directory, e.g.
+
+    docker compose run --rm app python -m scripts.migrate
+
+then start the app with VAPIORC_AUTOMIGRATE=0 so boots skip the schema checks.
+"""
+import asyncio
+import logging
+
+from core.db import create_schema, engine
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate():
+    # Also converts the legacy varchar id and status columns
+    await create_schema()
+    await engine.dispose()
+    logger.info("Database schema is up to date")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -1,97 +1,508 @@
-import subprocess
+import errno
+import fcntl
+import itertools
+import os
 import socket
 import logging
 import uuid
 import shutil
 import asyncio
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from functools import cached_property, partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import docker
+from sqlalchemy import and_, case, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from core.config import settings
-from core.db import GoldenImage, VMInstance, SessionLocal
+from core.db import GoldenImage, VMInstance, VMStatus, SessionLocal
+from core.mac_index import mac_index
 
 logger = logging.getLogger(__name__)
 
+# ioctl(2) request that shares a source file's extents with the destination (btrfs, XFS)
+FICLONE = 0x40049409
+# Errors meaning the filesystem or the source/destination pair cannot be reflinked or
+# copied in-kernel, so the next, slower strategy should be tried
+_NO_FAST_COPY_ERRNOS = {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS}
+# Below this size a plain copy beats setting up a clone
+REFLINK_MIN_SIZE = 1 << 20
+# Template files QEMU maps read-only (the UEFI firmware code), so instances can share them by hardlink.
+# The disks and the UEFI vars are written by the VM and must never be linked
+SHARED_TEMPLATE_SUFFIXES = (".rom",)
+# Errors meaning the file cannot be hardlinked here, so it is copied instead
+_NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP}
+# Files of a template tree copied at once; the copies release the GIL in the kernel or qemu-img
+COPY_WORKERS = 8
+# Released instance directories are renamed to this prefix and deleted by DELETE_WORKERS threads
+DELETING_PREFIX = ".deleting-"
+DELETE_WORKERS = 2
+
+# Image every golden image and VM instance container runs
+VM_IMAGE = "dockurr/windows"
+# Keep-alive connections to the Docker socket; asyncio.to_thread runs up to 32 calls at once
+DOCKER_POOL_SIZE = 32
+# Seconds Windows gets to shut down cleanly before docker kills the container
+VM_STOP_TIMEOUT = 120
+# containers.run options shared by every VM_IMAGE container; KVM plus the tap networking QEMU needs
+_VM_CONTAINER_OPTIONS = {
+    "detach": True,
+    "devices": ["/dev/kvm", "/dev/net/tun"],
+    "cap_add": ["NET_ADMIN"],
+    "stop_timeout": VM_STOP_TIMEOUT,
+}
+
+# Where instance containers see the template, read-only, so qcow2 overlays can resolve their backing file
+TEMPLATE_MOUNT = "/template"
+
+# An inspect is a single small API request, so container state can be polled often
+CONTAINER_POLL_INTERVAL = 0.2
+# Docker statuses of a container that has stopped and will not come up on its own
+STOPPED_STATES = ("exited", "dead")
+
+# A hot spare still starting after this many seconds is assumed lost when sizing the pool
+SPARE_BOOT_TIMEOUT = 900
+
+# How long a handed-out port stays reserved; covers the gap until docker run publishes it
+PORT_RESERVATION_TTL = 30.0
+
+# list_vms page size when the caller doesn't ask for one, and the largest it may ask for
+LIST_PAGE_SIZE = 500
+LIST_PAGE_MAX = 1000
+
+# Columns returned by list_vms, labelled with their API names; the status name is mapped in SQL
+_LIST_COLUMNS = (
+    VMInstance.id.label("instance_id"),
+    VMInstance.container_id,
+    VMInstance.vm_type,
+    case({state.value: state.name.lower() for state in VMStatus}, value=VMInstance.status).label("status"),
+    VMInstance.port,
+    VMInstance.is_hot_spare,
+    VMInstance.assigned_to,
+    VMInstance.created_at,
+)
+
+def _has_files(path: Path) -> bool:
+    """Whether path is a directory with at least one entry"""
+    try:
+        with os.scandir(path) as entries:
+            return next(entries, None) is not None
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+def _lower_thread_priority():
+    """Run the calling thread at the lowest CPU priority, which CFQ/BFQ also apply to its disk I/O"""
+    try:
+        # On Linux the priority is per thread when addressed by its thread id
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except OSError as e:
+        logger.debug(f"Could not lower deletion thread priority: {e}")
+
+def _rename_if_exists(src: Path, dst: Path) -> bool:
+    """Rename src to dst; False if src doesn't exist"""
+    try:
+        os.rename(src, dst)
+    except FileNotFoundError:
+        return False
+    return True
+
+def _is_port_conflict(error: docker.errors.APIError) -> bool:
+    """Whether docker failed to start a container because a published port is taken"""
+    explanation = str(error.explanation or error)
+    return "port is already allocated" in explanation or "address already in use" in explanation
+
+def _scan_tree(root: Path) -> Tuple[List[str], List[str]]:
+    """Directories (parents first, "" for root) and files under root, as paths relative to it"""
+    # scandir entries carry their type from getdents, so classifying them costs no stat
+    root = str(root)
+    directories, files = [], []
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        directories.append(relative)
+        with os.scandir(root + relative) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(f"{relative}/{entry.name}")
+                elif entry.is_file():
+                    files.append(f"{relative}/{entry.name}")
+    return directories, files
+
+def _plan_tree_copy(src_root: Path, dst_root: Path, tree: Tuple[List[str], List[str]]) -> List[Tuple[str, str]]:
+    """Mirror a scanned tree's directories under dst_root and return the (src, dst) file pairs to copy"""
+    # Paths are plain string splices onto the roots
+    src_root, dst_root = str(src_root), str(dst_root)
+    directories, files = tree
+    for relative in directories:
+        os.makedirs(dst_root + relative, exist_ok=True)
+    return [(src_root + relative, dst_root + relative) for relative in files]
+
+def _reflink_supported(src_dir: Path, dst_dir: Path) -> bool:
+    """Probe once whether files in src_dir can be reflinked into dst_dir"""
+    try:
+        with tempfile.NamedTemporaryFile(dir=src_dir) as src, tempfile.NamedTemporaryFile(dir=dst_dir) as dst:
+            src.write(b"\0")
+            src.flush()
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        return False
+
+def _reflink_copy(src: str, dst: str, reflink: bool = True):
+    """Clone a file with FICLONE if reflink is set, else copy_file_range, else a regular copy"""
+    if os.stat(src).st_size < REFLINK_MIN_SIZE:
+        shutil.copy2(src, dst)
+        return
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            if reflink:
+                try:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                except OSError as e:
+                    if e.errno not in _NO_FAST_COPY_ERRNOS:
+                        raise
+                    reflink = False
+            if not reflink:
+                # In-kernel copy; data never passes through userspace and NFS/XFS may still share extents
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+    except OSError as e:
+        if e.errno not in _NO_FAST_COPY_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+        return
+    shutil.copystat(src, dst)
+
+def _link_shared(src: str, dst: str, copy_function: Callable[[str, str], None]):
+    """Hardlink template files in SHARED_TEMPLATE_SUFFIXES, copying everything else with copy_function"""
+    if src.endswith(SHARED_TEMPLATE_SUFFIXES):
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            if e.errno not in _NO_LINK_ERRNOS:
+                raise
+    copy_function(src, dst)
+
+def _qcow2_overlay(src: str, dst: str, template_path: Path, reflink: bool = True):
+    """Create dst as a copy-on-write qcow2 overlay of the template disk src"""
+    if not src.endswith(".qcow2"):
+        _reflink_copy(src, dst, reflink)
+        return
+    # Create against the path visible here, then point the header at the path the VM container sees
+    backing_file = f"{TEMPLATE_MOUNT}/{os.path.relpath(src, template_path)}"
+    subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2", "-F", "qcow2", "-b", src, dst], check=True, capture_output=True)
+    subprocess.run(["qemu-img", "rebase", "-q", "-u", "-F", "qcow2", "-b", backing_file, dst], check=True, capture_output=True)
+
 class VMManager:
     """Core VM management service"""
     
     def __init__(self):
         settings.ensure_directories()
+        # Storage roots, built once instead of on every VM event
+        self._golden_root = Path(settings.GOLDEN_IMAGES_PATH)
+        self._instances_root = Path(settings.INSTANCES_PATH)
+        self._host_golden_root = Path(settings.HOST_GOLDEN_IMAGES_PATH)
+        self._host_instances_root = Path(settings.HOST_INSTANCES_PATH)
+        self._host_assets_path = settings.HOST_ASSETS_PATH
+        self._template_overlays = settings.TEMPLATE_OVERLAYS
+        self._container_options = {**_VM_CONTAINER_OPTIONS, "network": settings.DOCKER_NETWORK}
+        self._template_paths: Dict[str, Path] = {}
+        # Template file lists by VM type, keyed on the template directory's (inode, mtime)
+        self._template_trees: Dict[str, Tuple[Tuple[int, int], Tuple[List[str], List[str]]]] = {}
+        # Decided once per deployment so copies don't retry a failing ioctl for every file
+        self._reflink_ok = _reflink_supported(self._golden_root, self._instances_root)
+        logger.info(f"Reflink copies {'enabled' if self._reflink_ok else 'unavailable'} for {settings.CONTAINER_DATA_DIR}")
+        if not self._reflink_ok and not self._template_overlays:
+            logger.warning(
+                f"Every VM instance will be a full copy of the template: {settings.CONTAINER_DATA_DIR} "
+                f"has no reflink support and VAPIORC_TEMPLATE_OVERLAYS is off"
+            )
         self._hot_spare_lock = asyncio.Lock()
+        # Serializes template builds per VM type; see mark_golden_image_ready
+        self._template_locks: Dict[str, asyncio.Lock] = {}
+        self._started_at = datetime.now(timezone.utc)
+        # Set when the pool may have dipped; start() refills once per wake-up however many requests came in
+        self._spares_wanted = asyncio.Event()
+        # Set once VM_IMAGE is known to be local; see ensure_vm_image
+        self._image_lock = asyncio.Lock()
+        self._image_ready = False
+        # Process-wide cap on hot spares booting at once
+        self._spare_slots = asyncio.Semaphore(settings.HOT_SPARE_CONCURRENCY)
+        self._copy_pool = ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="vapiorc-copy")
+        # Deletions get their own small pool so a burst of releases can't starve other threaded work
+        self._delete_pool = ThreadPoolExecutor(
+            max_workers=DELETE_WORKERS, thread_name_prefix="vapiorc-delete", initializer=_lower_thread_priority
+        )
+        # Fire-and-forget work, referenced until done so it isn't garbage collected
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Ports handed out recently, so concurrent creations never pick the same one
+        self._reserved_ports: Dict[int, float] = {}
+        # The scan resumes after the last port handed out, where the next free one usually is
+        self._next_port = settings.PORT_RANGE_START
+    
+    @cached_property
+    def docker_client(self) -> docker.DockerClient:
+        """Docker Engine API client, created on first use; keeps its unix socket connections alive"""
+        # Sized for the worker threads calling it at once; beyond the pool size (default 10)
+        # urllib3 discards connections after each request
+        return docker.from_env(max_pool_size=DOCKER_POOL_SIZE)
+    
+    def close(self):
+        """Release the Docker connections and worker pools at shutdown"""
+        if "docker_client" in self.__dict__:
+            self.docker_client.close()
+        # Interrupted deletions are finished by the .deleting- sweep on the next start
+        self._copy_pool.shutdown(wait=False, cancel_futures=True)
+        self._delete_pool.shutdown(wait=False, cancel_futures=True)
+    
+    async def start(self):
+        """Background work for the app's lifetime: make sure the VM image is local, then keep the hot spare pool full"""
+        # Finish deletions a restart interrupted
+        for deleting_path in await asyncio.to_thread(list, self._instances_root.glob(f"{DELETING_PREFIX}*")):
+            self._run_in_background(self._delete_tree(deleting_path))
+        try:
+            await self._reconcile_hot_spares()
+        except Exception as e:
+            logger.error(f"Error reconciling hot spares: {e}")
+        await self.ensure_vm_image()
+        while True:
+            try:
+                await self.ensure_hot_spares()
+            except Exception as e:
+                logger.error(f"Error replenishing hot spares: {e}")
+            await self._spares_wanted.wait()
+            self._spares_wanted.clear()
+    
+    async def _reconcile_hot_spares(self):
+        """Destroy unassigned hot spares that didn't survive the restart, so the first refill replaces them"""
+        spare_rows = (
+            VMInstance.is_hot_spare == True,
+            VMInstance.status.in_((VMStatus.STARTING, VMStatus.READY)),
+            VMInstance.assigned_to.is_(None),
+            # Rows from before this process; newer ones belong to its own provisioning
+            VMInstance.created_at < self._started_at
+        )
+        async with SessionLocal() as db:
+            spares = (await db.execute(select(VMInstance.id, VMInstance.container_id).where(*spare_rows))).all()
+        if not spares:
+            return
+        
+        # Spares are kept across restarts; their rows only lie when the container is gone, or
+        # was never started because the previous process stopped while provisioning it
+        def is_running(container_id: Optional[str]) -> bool:
+            return container_id is not None and self._container_state(container_id) == "running"
+        
+        running = await asyncio.gather(*(asyncio.to_thread(is_running, spare.container_id) for spare in spares))
+        dead_ids = [spare.id for spare, alive in zip(spares, running) if not alive]
+        logger.info(f"{len(spares) - len(dead_ids)} of {len(spares)} hot spares survived the restart")
+        if not dead_ids:
+            return
+        
+        await self.destroy_vms([str(dead_id) for dead_id in dead_ids])
+    
+    def request_hot_spares(self):
+        """Ask the background refiller to top up the hot spare pool; returns immediately"""
+        self._spares_wanted.set()
     
-    def find_available_port(self) -> Optional[int]:
-        """Find an available port in the configured range"""
-        for port in range(settings.PORT_RANGE_START, settings.PORT_RANGE_END):
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(1)
-                if s.connect_ex(('0.0.0.0', port)) != 0:
-                    # Double-check by trying to bind to the port
-                    try:
-                        test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        test_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                        test_socket.bind(('', port))
-                        test_socket.close()
-                        logger.debug(f"Found available port: {port}")
-                        return port
-                    except OSError:
-                        logger.debug(f"Port {port} is busy")
-                        continue
-                else:
+    async def ensure_vm_image(self):
+        """
+        Make sure VM_IMAGE is local before any container is started
+        
+        Concurrent callers wait for a single check or pull instead of each docker run
+        pulling the image on its own; once it succeeds, later calls return at once.
+        """
+        if self._image_ready:
+            return
+        async with self._image_lock:
+            if not self._image_ready:
+                self._image_ready = await asyncio.to_thread(self._pull_vm_image)
+    
+    def _pull_vm_image(self) -> bool:
+        """Pull VM_IMAGE if it is missing; blocking. Returns whether the image is available"""
+        try:
+            self.docker_client.images.get(VM_IMAGE)
+            logger.info(f"Image {VM_IMAGE} is available locally")
+        except docker.errors.ImageNotFound:
+            logger.info(f"Pulling image {VM_IMAGE}")
+            try:
+                self.docker_client.images.pull(VM_IMAGE, tag="latest")
+            except docker.errors.DockerException as e:
+                logger.warning(f"Could not pull image {VM_IMAGE}: {e}")
+                return False
+        except docker.errors.DockerException as e:
+            logger.warning(f"Could not check image {VM_IMAGE}: {e}")
+            return False
+        return True
+    
+    def _run_in_background(self, coro):
+        """Run a coroutine without awaiting it"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _clone_tree(
+        self, src_root: Path, dst_root: Path, tree: Tuple[List[str], List[str]], copy_function: Callable[[str, str], None]
+    ):
+        """Copy a scanned directory tree, running the per-file copies concurrently on the copy pool"""
+        loop = asyncio.get_running_loop()
+        pairs = await asyncio.to_thread(_plan_tree_copy, src_root, dst_root, tree)
+        # Let every copy finish before raising so a cleanup never races a copy still writing
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._copy_pool, copy_function, src, dst) for src, dst in pairs),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+    
+    async def _delete_tree(self, path: Path):
+        """Delete a directory tree on the deletion pool"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._delete_pool, partial(shutil.rmtree, path, ignore_errors=True))
+        logger.info(f"Removed {path}")
+    
+    def _template_path(self, vm_type: str) -> Path:
+        """Path of the preload template for a VM type"""
+        template_path = self._template_paths.get(vm_type)
+        if template_path is None:
+            template_path = self._template_paths[vm_type] = self._golden_root / f"{vm_type}_template"
+        return template_path
+    
+    async def _template_tree(self, vm_type: str) -> Tuple[List[str], List[str]]:
+        """The template's scanned tree, rescanned only when the template directory changes"""
+        template_path = self._template_path(vm_type)
+        try:
+            stat = await asyncio.to_thread(os.stat, template_path)
+        except FileNotFoundError:
+            raise Exception(f"No golden image template for {vm_type}")
+        # A template swap renames a new directory into place, which changes the inode
+        version = (stat.st_ino, stat.st_mtime_ns)
+        cached = self._template_trees.get(vm_type)
+        if cached and cached[0] == version:
+            return cached[1]
+        tree = await asyncio.to_thread(_scan_tree, template_path)
+        self._template_trees[vm_type] = (version, tree)
+        return tree
+    
+    async def find_available_port(self) -> Optional[int]:
+        """Find an available port in the configured range and reserve it for PORT_RESERVATION_TTL"""
+        # Nothing here awaits, so concurrent callers can't interleave between scan and reservation
+        now = time.monotonic()
+        self._reserved_ports = {
+            port: reserved_at for port, reserved_at in self._reserved_ports.items()
+            if now - reserved_at < PORT_RESERVATION_TTL
+        }
+        
+        start, end = settings.PORT_RANGE_START, settings.PORT_RANGE_END
+        first = self._next_port if start <= self._next_port < end else start
+        # A bind without SO_REUSEADDR fails for any port in use; docker's own bind is the
+        # final check, and _run_vm_container retries if it loses a race
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            for port in itertools.chain(range(first, end), range(start, first)):
+                if port in self._reserved_ports:
+                    continue
+                try:
+                    probe.bind(('', port))
+                except OSError:
                     logger.debug(f"Port {port} is in use")
-        logger.warning(f"No available ports found in range {settings.PORT_RANGE_START}-{settings.PORT_RANGE_END}")
+                    continue
+                logger.debug(f"Found available port: {port}")
+                self._reserved_ports[port] = now
+                self._next_port = port + 1
+                return port
+        logger.warning(f"No available ports found in range {start}-{end}")
         return None
     
+    async def _run_vm_container(
+        self, name: str, ports: Callable[[int], Dict[str, int]], vm_type: str, mac_address: str, volumes: Dict[str, dict]
+    ) -> Tuple[Any, int]:
+        """Start a VM_IMAGE container on a free port, retrying once if the port was taken meanwhile"""
+        environment = {"VERSION": vm_type, "DISK_FMT": "qcow2", "MAC": mac_address}
+        await self.ensure_vm_image()
+        for attempt in range(2):
+            port = await self.find_available_port()
+            if not port:
+                raise Exception("No available ports")
+            try:
+                container = await asyncio.to_thread(
+                    self.docker_client.containers.run,
+                    VM_IMAGE,
+                    name=name,
+                    ports=ports(port),
+                    environment=environment,
+                    volumes=volumes,
+                    **self._container_options
+                )
+                return container, port
+            except docker.errors.APIError as e:
+                if attempt or not _is_port_conflict(e):
+                    raise
+                # The container was created but could not start; free the name for the retry
+                logger.warning(f"Port {port} was taken before {name} started, retrying on another port")
+                await asyncio.to_thread(self.docker_client.api.remove_container, name, force=True)
+    
+    def _assign_mac(self, container_id: str, container_type: str, storage_path: Path) -> str:
+        """Derive a locally administered MAC address from the container id and index it; blocking"""
+        hex_id = container_id.replace('-', '')
+        mac_address = ":".join(["02"] + [hex_id[i:i + 2] for i in range(0, 10, 2)]).upper()
+        
+        # The container gets the MAC via the MAC env var; the file keeps rescans working.
+        # Written aside and renamed so a crash never leaves a truncated .mac for the index rebuild
+        mac_file = storage_path / "windows.mac"
+        staging_file = mac_file.with_name(f".{mac_file.name}.tmp")
+        staging_file.write_text(mac_address)
+        os.replace(staging_file, mac_file)
+        mac_index.register(mac_address, container_id, container_type, storage_path)
+        return mac_address
+    
     async def create_golden_image(self, vm_type: str = "11") -> str:
         """Create a golden image by starting a VM and waiting for Windows installation"""
-        golden_id = str(uuid.uuid4())
+        golden_image_id = uuid.uuid4()
+        golden_id = str(golden_image_id)
         
         # Create database record
-        db = SessionLocal()
-        try:
+        async with SessionLocal() as db:
             golden_image = GoldenImage(
-                id=golden_id,
+                id=golden_image_id,
                 vm_type=vm_type,
                 status="creating"
             )
             db.add(golden_image)
-            db.commit()
-        finally:
-            db.close()
+            await db.commit()
         
         try:
             # Create golden image directory
-            golden_path = Path(settings.GOLDEN_IMAGES_PATH) / golden_id
-            golden_path.mkdir(parents=True, exist_ok=True)
-            
-            # Find available port
-            port = self.find_available_port()
-            if not port:
-                raise Exception("No available ports")
+            golden_path = self._golden_root / golden_id
+            await asyncio.to_thread(golden_path.mkdir, parents=True, exist_ok=True)
+            mac_address = await asyncio.to_thread(self._assign_mac, golden_id, "golden_image", golden_path)
             
             # Start golden image container with OEM folder for post-install automation
             container_name = f"vapiorc_golden_{golden_id}"
             # Use host paths for Docker volume mounting
-            host_golden_path = Path(settings.HOST_GOLDEN_IMAGES_PATH) / golden_id
-            host_assets_path = settings.HOST_ASSETS_PATH
-            
-            cmd = [
-                "docker", "run", "-d",
-                "--name", container_name,
-                "--network", settings.DOCKER_NETWORK,
-                "-p", f"{port}:8006",
-                "-e", f"VERSION={vm_type}",
-                "-e", "DISK_FMT=qcow2",
-                "-v", f"{host_golden_path}:/storage",
-                "-v", f"{host_assets_path}:/oem",  # Mount assets folder as OEM for auto-install
-                "--device=/dev/kvm",
-                "--device=/dev/net/tun",
-                "--cap-add", "NET_ADMIN",
-                "--stop-timeout", "120",
-                "dockurr/windows"
-            ]
+            host_golden_path = self._host_golden_root / golden_id
             
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            container_id = result.stdout.strip()
+            container, port = await self._run_vm_container(
+                container_name,
+                lambda port: {"8006/tcp": port},
+                vm_type,
+                mac_address,
+                volumes={
+                    str(host_golden_path): {"bind": "/storage", "mode": "rw"},
+                    self._host_assets_path: {"bind": "/oem", "mode": "rw"},  # Mount assets folder as OEM for auto-install
+                }
+            )
+            container_id = container.id
             
             logger.info(f"Started golden image container {container_name} (ID: {container_id}) on port {port}")
             
@@ -104,68 +515,57 @@ class VMManager:
             
         except Exception as e:
             # Update status to failed
-            db = SessionLocal()
-            try:
-                golden_image = db.query(GoldenImage).filter(GoldenImage.id == golden_id).first()
-                if golden_image:
-                    golden_image.status = "failed"
-                    db.commit()
-            finally:
-                db.close()
+            async with SessionLocal() as db:
+                await db.execute(update(GoldenImage).where(GoldenImage.id == golden_image_id).values(status="failed"))
+                await db.commit()
             raise e
     
     async def mark_golden_image_ready(self, golden_id: str):
         """Mark a golden image as ready and create preload template"""
         try:
-            db = SessionLocal()
-            try:
-                golden_image = db.query(GoldenImage).filter(GoldenImage.id == golden_id).first()
-                if not golden_image:
-                    raise Exception(f"Golden image {golden_id} not found")
+            # Short sessions around the reads and the final write; no pooled connection is
+            # held while the container shuts down or the template is built
+            golden_image_id = uuid.UUID(golden_id)
+            async with SessionLocal() as db:
+                vm_type = await db.scalar(select(GoldenImage.vm_type).where(GoldenImage.id == golden_image_id))
+            if vm_type is None:
+                raise Exception(f"Golden image {golden_id} not found")
+            
+            golden_path = self._golden_root / golden_id
+            template_path = self._template_path(vm_type)
+            # Duplicate readiness reports are normal (the reporter retries, the manual route exists),
+            # so only one template build per VM type runs at a time
+            async with self._template_locks.setdefault(vm_type, asyncio.Lock()):
+                await self._teardown_golden_container(golden_id)
                 
-                golden_path = Path(settings.GOLDEN_IMAGES_PATH) / golden_id
+                # Checked after the teardown and under the lock, so a duplicate report that waited
+                # for another build sees its result
                 if not golden_path.exists():
-                    raise Exception(f"Golden image path {golden_path} does not exist")
-                
-                # First shutdown the golden image container
-                container_name = f"vapiorc_golden_{golden_id}"
-                logger.info(f"Shutting down golden image container {container_name} before template creation")
-                try:
-                    subprocess.run(["docker", "stop", container_name], check=True, capture_output=True)
-                    subprocess.run(["docker", "rm", container_name], check=True, capture_output=True)
-                    logger.info(f"Successfully shut down and removed container {container_name}")
-                except subprocess.CalledProcessError as e:
-                    logger.warning(f"Error shutting down container {container_name}: {e}")
-                
-                # Remove .mac files from golden image before copying
-                logger.info("Removing MAC address files from golden image before template creation")
-                for mac_file in golden_path.glob("*.mac"):
-                    mac_file.unlink()
-                    logger.info(f"Removed MAC file: {mac_file}")
-                
-                # Now copy to template
-                template_path = Path(settings.GOLDEN_IMAGES_PATH) / f"{golden_image.vm_type}_template"
-                
-                # Remove existing template if it exists
-                if template_path.exists():
-                    logger.info(f"Removing existing template at {template_path}")
-                    shutil.rmtree(template_path)
-                
-                logger.info(f"Copying golden image from {golden_path} to {template_path}")
-                shutil.copytree(golden_path, template_path)
-                
-                # Remove the original golden image files to save space
-                if golden_path.exists():
-                    logger.info(f"Removing original golden image files at {golden_path}")
-                    shutil.rmtree(golden_path)
-                
-                golden_image.status = "ready"
-                db.commit()
+                    if not _has_files(template_path):
+                        raise Exception(f"Golden image path {golden_path} does not exist")
+                    # The golden image files were already moved into the template; only the row is left
+                    logger.info(f"Template {template_path} already built from golden image {golden_id}")
+                    async with SessionLocal() as db:
+                        await db.execute(update(GoldenImage).where(GoldenImage.id == golden_image_id).values(status="ready"))
+                        await db.commit()
+                    return
                 
-                logger.info(f"Golden image {golden_id} marked as ready, template created, and original files cleaned up")
-            finally:
-                db.close()
+                # Template creation is all disk I/O, so it runs in a worker thread
+                retired_path = await asyncio.to_thread(self._create_template, golden_path, template_path)
+                self._template_trees.pop(vm_type, None)
+                mac_index.evict(golden_id)
                 
+                async with SessionLocal() as db:
+                    await db.execute(update(GoldenImage).where(GoldenImage.id == golden_image_id).values(status="ready"))
+                    await db.commit()
+            
+            if retired_path:
+                # Nothing reads the old template any more, so don't hold up hot spares for it
+                logger.info(f"Removing previous template at {retired_path} in the background")
+                self._run_in_background(self._delete_tree(retired_path))
+            
+            logger.info(f"Golden image {golden_id} marked as ready, template created, and original files cleaned up")
+            
             # Template is now ready - hot spares will be created by the calling ensure_hot_spares method
             logger.info("Golden image template creation completed")
                 
@@ -173,139 +573,221 @@ class VMManager:
             logger.error(f"Error marking golden image ready: {e}")
             raise
     
-    async def create_vm_instance(self, vm_type: str = "11", is_hot_spare: bool = False) -> str:
-        """Create a new VM instance from golden image"""
-        instance_id = str(uuid.uuid4())
+    async def _teardown_golden_container(self, golden_id: str):
+        """Shut down and remove a golden image's container if it is still there"""
+        container_name = f"vapiorc_golden_{golden_id}"
+        logger.info(f"Shutting down golden image container {container_name} before template creation")
+        try:
+            container = await asyncio.to_thread(self.docker_client.containers.get, container_name)
+            # Pass the timeout so the SDK's HTTP timeout covers the whole guest shutdown
+            await asyncio.to_thread(container.stop, timeout=VM_STOP_TIMEOUT)
+            await asyncio.to_thread(container.remove)
+            logger.info(f"Successfully shut down and removed container {container_name}")
+        except docker.errors.NotFound:
+            logger.info(f"Golden image container {container_name} is already gone")
+        except docker.errors.DockerException as e:
+            logger.warning(f"Error shutting down container {container_name}: {e}")
+    
+    def _create_template(self, golden_path: Path, template_path: Path) -> Optional[Path]:
+        """
+        Turn a shut down golden image into the preload template; blocking
         
-        # Create database record
-        db = SessionLocal()
+        The new template is built next to the current one and renamed into place, so
+        concurrent instance creation keeps using the old template until the swap.
+        
+        Returns:
+            Optional[Path]: The replaced template, for the caller to delete
+        """
+        # Remove .mac files from golden image before copying
+        logger.info("Removing MAC address files from golden image before template creation")
+        with os.scandir(golden_path) as entries:
+            for entry in entries:
+                if entry.name.endswith(".mac"):
+                    os.unlink(entry.path)
+                    logger.info(f"Removed MAC file: {entry.path}")
+        
+        staging_path = template_path.with_name(f"{template_path.name}.new")
+        if staging_path.exists():
+            shutil.rmtree(staging_path)
+        
+        # The golden image files are not needed afterwards, so move them instead of copying
         try:
+            os.rename(golden_path, staging_path)
+            logger.info(f"Moved golden image from {golden_path} to {staging_path}")
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            logger.info(f"Copying golden image from {golden_path} to {staging_path}")
+            shutil.copytree(golden_path, staging_path, copy_function=partial(_reflink_copy, reflink=self._reflink_ok))
+        
+        # Instances hardlink the shared files, and overlays read through to the disks, so
+        # freeze them; copied disks stay writable since the copy keeps the template's mode
+        frozen_suffixes = SHARED_TEMPLATE_SUFFIXES
+        if self._template_overlays:
+            frozen_suffixes += (".qcow2",)
+        for dir_path, _, file_names in os.walk(staging_path):
+            for file_name in file_names:
+                if file_name.endswith(frozen_suffixes):
+                    os.chmod(os.path.join(dir_path, file_name), 0o444)
+        
+        # Swap the new template in with two renames instead of an rmtree/copytree gap
+        retired_path = None
+        if template_path.exists():
+            retired_path = template_path.with_name(f"{template_path.name}.old")
+            if retired_path.exists():
+                shutil.rmtree(retired_path)
+            os.rename(template_path, retired_path)
+        os.rename(staging_path, template_path)
+        logger.info(f"Template {template_path} is in place")
+        
+        # Remove the original golden image files if they had to be copied
+        if golden_path.exists():
+            logger.info(f"Removing original golden image files at {golden_path}")
+            shutil.rmtree(golden_path)
+        return retired_path
+    
+    async def create_vm_instance(self, vm_type: str = "11", is_hot_spare: bool = False) -> str:
+        """Create a new VM instance from golden image"""
+        # One session for the whole creation; it only holds a pooled connection
+        # between a statement and its commit, not while the container boots
+        async with SessionLocal() as db:
             vm_instance = VMInstance(
-                id=instance_id,
+                id=uuid.uuid4(),
                 vm_type=vm_type,
-                status="starting",
+                status=VMStatus.STARTING,
                 is_hot_spare=is_hot_spare
             )
             db.add(vm_instance)
-            db.commit()
-        finally:
-            db.close()
+            await db.commit()
+            return await self._provision_vm_instance(db, vm_instance.id, vm_type)
+    
+    async def _provision_vm_instance(self, db: AsyncSession, vm_instance_id: uuid.UUID, vm_type: str) -> str:
+        """Copy the template and boot the container for an already inserted instance row"""
+        instance_id = str(vm_instance_id)
         
         try:
             # Create instance directory
-            instance_path = Path(settings.INSTANCES_PATH) / instance_id
-            instance_path.mkdir(parents=True, exist_ok=True)
+            instance_path = self._instances_root / instance_id
+            await asyncio.to_thread(instance_path.mkdir, parents=True, exist_ok=True)
             
             # Copy from template
-            template_path = Path(settings.GOLDEN_IMAGES_PATH) / f"{vm_type}_template"
-            if not template_path.exists():
-                raise Exception(f"No golden image template for {vm_type}")
+            template_path = self._template_path(vm_type)
+            template_tree = await self._template_tree(vm_type)
             
-            # Fast copy using hardlinks where possible
-            for item in template_path.rglob('*'):
-                if item.is_file():
-                    relative = item.relative_to(template_path)
-                    dest = instance_path / relative
-                    dest.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(item, dest)
-            
-            # Find available port
-            port = self.find_available_port()
-            if not port:
-                raise Exception("No available ports")
+            if self._template_overlays:
+                # Disks become qcow2 overlays on the template: a few KB of header instead of a full copy
+                copy_function = partial(_qcow2_overlay, template_path=template_path, reflink=self._reflink_ok)
+            else:
+                # Reflink the template's disk images so the clone is a metadata operation on CoW filesystems
+                copy_function = partial(_reflink_copy, reflink=self._reflink_ok)
+            await self._clone_tree(template_path, instance_path, template_tree, partial(_link_shared, copy_function=copy_function))
+            mac_address = await asyncio.to_thread(self._assign_mac, instance_id, "vm_instance", instance_path)
             
             # Start VM container with OEM folder for readiness reporting
             container_name = f"vapiorc_vm_{instance_id}"
             # Use host paths for Docker volume mounting
-            host_instance_path = Path(settings.HOST_INSTANCES_PATH) / instance_id
-            host_assets_path = settings.HOST_ASSETS_PATH
+            host_instance_path = self._host_instances_root / instance_id
+            volumes = {
+                str(host_instance_path): {"bind": "/storage", "mode": "rw"},
+                self._host_assets_path: {"bind": "/oem", "mode": "rw"},  # Mount assets folder as OEM for readiness reporting
+            }
+            if self._template_overlays:
+                # The overlay disks read through to the template's backing files
+                host_template_path = self._host_golden_root / f"{vm_type}_template"
+                volumes[str(host_template_path)] = {"bind": TEMPLATE_MOUNT, "mode": "ro"}
             
-            cmd = [
-                "docker", "run", "-d",
-                "--name", container_name,
-                "--network", settings.DOCKER_NETWORK,
-                "-p", f"{port}:8006",
-                "-p", f"{port + 1000}:3389",  # RDP port
-                "-e", f"VERSION={vm_type}",
-                "-e", "DISK_FMT=qcow2",
-                "-v", f"{host_instance_path}:/storage",
-                "-v", f"{host_assets_path}:/oem",  # Mount assets folder as OEM for readiness reporting
-                "--device=/dev/kvm",
-                "--device=/dev/net/tun",
-                "--cap-add", "NET_ADMIN",
-                "--stop-timeout", "120",
-                "dockurr/windows"
-            ]
-            
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-            container_id = result.stdout.strip()
+            container, port = await self._run_vm_container(
+                container_name,
+                lambda port: {"8006/tcp": port, "3389/tcp": port + 1000},  # noVNC and RDP
+                vm_type,
+                mac_address,
+                volumes
+            )
+            container_id = container.id
             
-            # Update database record
-            db = SessionLocal()
-            try:
-                vm_instance = db.query(VMInstance).filter(VMInstance.id == instance_id).first()
-                if vm_instance:
-                    vm_instance.container_id = container_id
-                    vm_instance.port = port
-                    vm_instance.status = "starting"  # Will be updated to "ready" via webhook
-                    db.commit()
-            finally:
-                db.close()
+            # Update database record; status stays STARTING until the readiness webhook
+            await db.execute(
+                update(VMInstance)
+                .where(VMInstance.id == vm_instance_id)
+                .values(container_id=container_id, port=port)
+            )
+            await db.commit()
             
             logger.info(f"Started VM instance {instance_id} on port {port}")
             
-            # Wait for container to start - qemu/kvm will create .mac files automatically
-            await self._wait_for_container_ready(container_id)
+            # Wait for container to start - qemu/kvm will create .mac files automatically.
+            # A container that already stopped will never report ready, so fail it now
+            # instead of letting it hold a pool slot until SPARE_BOOT_TIMEOUT
+            state = await self._wait_for_container_ready(container_id)
+            if state in STOPPED_STATES:
+                raise Exception(f"Container for VM instance {instance_id} {state} while starting")
             
             return instance_id
             
         except Exception as e:
             # Update status to failed and cleanup
-            db = SessionLocal()
-            try:
-                vm_instance = db.query(VMInstance).filter(VMInstance.id == instance_id).first()
-                if vm_instance:
-                    vm_instance.status = "failed"
-                    db.commit()
-            finally:
-                db.close()
+            await db.rollback()
+            await db.execute(
+                update(VMInstance)
+                .where(VMInstance.id == vm_instance_id)
+                .values(status=VMStatus.FAILED)
+            )
+            await db.commit()
             await self.cleanup_vm_instance(instance_id)
             raise e
-    
+
     async def assign_vm(self, assigned_to: str) -> Optional[Dict[str, Any]]:
         """Assign a hot spare VM to a user/task"""
-        db = SessionLocal()
-        try:
-            # Find available hot spare
-            vm = db.query(VMInstance).filter(
-                VMInstance.is_hot_spare == True,
-                VMInstance.status == "ready",
-                VMInstance.assigned_to.is_(None)
-            ).first()
-            
-            if not vm:
-                # No hot spares available, create one
-                instance_id = await self.create_vm_instance(is_hot_spare=False)
-                vm = db.query(VMInstance).filter(VMInstance.id == instance_id).first()
-            
-            if vm:
-                vm.assigned_to = assigned_to
-                vm.is_hot_spare = False
-                vm.status = "busy"
-                db.commit()
-                
-                # Ensure hot spare pool is replenished
-                await self.ensure_hot_spares()
-                
-                return {
-                    "instance_id": vm.id,
-                    "container_id": vm.container_id,
-                    "port": vm.port,
-                    "novnc_url": f"http://localhost:{vm.port}",
-                    "rdp_port": vm.port + 1000
-                }
-        finally:
-            db.close()
+        claim_values = {"assigned_to": assigned_to, "is_hot_spare": False, "status": VMStatus.BUSY}
+        returned_columns = (VMInstance.id, VMInstance.container_id, VMInstance.port)
+        spare_available = (
+            VMInstance.is_hot_spare == True,
+            VMInstance.status == VMStatus.READY,
+            VMInstance.assigned_to.is_(None)
+        )
+        async with SessionLocal() as db:
+            # Claim an available hot spare in one round-trip. The predicate is repeated on the
+            # UPDATE so a spare claimed concurrently fails the recheck instead of being handed out twice
+            # SKIP LOCKED lets concurrent claims pass over a row another transaction is taking
+            spare_id = (
+                select(VMInstance.id).where(*spare_available).limit(1)
+                .with_for_update(skip_locked=True).scalar_subquery()
+            )
+            vm = (await db.execute(
+                update(VMInstance)
+                .where(VMInstance.id == spare_id, *spare_available)
+                .values(**claim_values)
+                .returning(*returned_columns)
+            )).first()
+            await db.commit()
+        
+        if not vm and settings.HOT_SPARE_COUNT > 0:
+            # Don't make the caller wait for a boot; the refiller is told below and the
+            # caller retries once a spare is ready
+            logger.info(f"No hot spare available for {assigned_to}")
+        elif not vm:
+            # Hot spares are disabled, so create one on demand and claim it in its own session
+            instance_id = await self.create_vm_instance(is_hot_spare=False)
+            async with SessionLocal() as db:
+                vm = (await db.execute(
+                    update(VMInstance)
+                    .where(VMInstance.id == uuid.UUID(instance_id))
+                    .values(**claim_values)
+                    .returning(*returned_columns)
+                )).first()
+                await db.commit()
+        
+        # Replenish the hot spare pool without holding up the assignment
+        self.request_hot_spares()
+        
+        if vm:
+            return {
+                "instance_id": str(vm.id),
+                "container_id": vm.container_id,
+                "port": vm.port,
+                "novnc_url": f"http://localhost:{vm.port}",
+                "rdp_port": vm.port + 1000
+            }
         
         return None
     
@@ -315,43 +797,58 @@ class VMManager:
         await self.destroy_vm(instance_id)
         
         # Ensure hot spare pool is replenished after destroying a VM
-        await self.ensure_hot_spares()
+        self.request_hot_spares()
     
     async def destroy_vm(self, instance_id: str):
         """Completely destroy a VM instance"""
-        await self.cleanup_vm_instance(instance_id)
+        await self.destroy_vms([instance_id])
+    
+    async def destroy_vms(self, instance_ids: List[str]):
+        """Completely destroy several VM instances, deleting their rows in one statement"""
+        if not instance_ids:
+            return
+        await self.cleanup_vm_instances(instance_ids)
         
-        db = SessionLocal()
-        try:
-            vm = db.query(VMInstance).filter(VMInstance.id == instance_id).first()
-            if vm:
-                db.delete(vm)
-                db.commit()
-        finally:
-            db.close()
+        async with SessionLocal() as db:
+            await db.execute(delete(VMInstance).where(VMInstance.id.in_([uuid.UUID(i) for i in instance_ids])))
+            await db.commit()
         
-        logger.info(f"Destroyed VM instance {instance_id}")
+        for instance_id in instance_ids:
+            logger.info(f"Destroyed VM instance {instance_id}")
     
     async def cleanup_vm_instance(self, instance_id: str):
         """Clean up VM instance resources"""
+        # The instance disk is deleted below, so force-remove rather than stop gracefully first;
+        # v=True also drops any anonymous volumes, like docker rm -f --volumes
+        container_name = f"vapiorc_vm_{instance_id}"
         try:
-            # Stop and remove container
-            container_name = f"vapiorc_vm_{instance_id}"
-            logger.info(f"Stopping container {container_name}")
-            subprocess.run(["docker", "stop", container_name], check=False, capture_output=True)
-            subprocess.run(["docker", "rm", container_name], check=False, capture_output=True)
-            logger.info(f"Container {container_name} stopped and removed")
+            logger.info(f"Removing container {container_name}")
+            await asyncio.to_thread(self.docker_client.api.remove_container, container_name, v=True, force=True)
+            logger.info(f"Container {container_name} removed")
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            logger.error(f"Error removing container {container_name}: {e}")
+        
+        try:
+            mac_index.evict(instance_id)
             
-            # Remove instance directory and all files (for security)
-            instance_path = Path(settings.INSTANCES_PATH) / instance_id
-            if instance_path.exists():
-                logger.info(f"Removing VM instance files at {instance_path}")
-                shutil.rmtree(instance_path)
-                logger.info(f"VM instance {instance_id} files completely removed for security")
+            # Remove instance directory and all files (for security). The rename is instant,
+            # so callers don't wait on the multi-GB delete, which finishes in the background
+            instance_path = self._instances_root / instance_id
+            deleting_path = instance_path.with_name(f"{DELETING_PREFIX}{instance_id}")
+            if await asyncio.to_thread(_rename_if_exists, instance_path, deleting_path):
+                logger.info(f"Removing VM instance files at {deleting_path}")
+                self._run_in_background(self._delete_tree(deleting_path))
                 
         except Exception as e:
             logger.error(f"Error cleaning up VM instance {instance_id}: {e}")
     
+    async def cleanup_vm_instances(self, instance_ids: List[str]):
+        """Clean up the resources of several VM instances at once"""
+        # The Engine API removes one container per request, so overlap the requests instead
+        await asyncio.gather(*(self.cleanup_vm_instance(instance_id) for instance_id in instance_ids))
+    
     async def ensure_hot_spares(self):
         """Ensure we have the configured number of hot spares"""
         # Skip if hot spares are disabled
@@ -359,126 +856,167 @@ class VMManager:
             logger.info("Hot spare count is 0, skipping hot spare creation")
             return
         
-        # Use lock to prevent concurrent calls
+        # The lock covers deciding how many spares to start and inserting their rows,
+        # not the container boots, so concurrent calls see each other's spares
         async with self._hot_spare_lock:
             logger.info("Acquired hot spare management lock")
-            await self._ensure_hot_spares_internal()
+            spare_ids = await self._ensure_hot_spares_internal()
+        if not spare_ids:
+            return
+        
+        async def boot_spare(index: int, vm_instance_id: uuid.UUID):
+            async with self._spare_slots:
+                logger.info(f"Creating hot spare {index + 1} of {len(spare_ids)}")
+                async with SessionLocal() as db:
+                    await self._provision_vm_instance(db, vm_instance_id, settings.VM_TYPE)
+        
+        results = await asyncio.gather(
+            *(boot_spare(i, vm_instance_id) for i, vm_instance_id in enumerate(spare_ids)), return_exceptions=True
+        )
+        failed_ids = []
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                logger.error(f"Error creating hot spare {i + 1}: {result}")
+                failed_ids.append(str(spare_ids[i]))
+        
+        # A failed spare was never handed out, so drop its row instead of keeping it as failed
+        await self.destroy_vms(failed_ids)
     
-    async def _ensure_hot_spares_internal(self):
-        """Internal method to ensure hot spares (called within lock)"""
+    async def _ensure_hot_spares_internal(self) -> List[uuid.UUID]:
+        """Internal method to ensure hot spares (called within lock); returns inserted spare rows to boot"""
         # First check if we have a valid golden image template
-        template_path = Path(settings.GOLDEN_IMAGES_PATH) / "11_template"
-        template_exists = template_path.exists()
-        template_has_files = template_exists and any(template_path.iterdir()) if template_exists else False
+        template_path = self._template_path("11")
+        template_has_files = _has_files(template_path)
         
-        logger.info(f"Template path: {template_path}, exists: {template_exists}, has files: {template_has_files}")
+        logger.info(f"Template path: {template_path}, has files: {template_has_files}")
         
-        if not template_exists or not template_has_files:
+        if not template_has_files:
             logger.info("No valid golden image template found, checking for golden images to create template")
             
-            # Check if there's a ready golden image we can use
-            db = SessionLocal()
-            try:
-                ready_golden = db.query(GoldenImage).filter(
-                    GoldenImage.vm_type == "11",
-                    GoldenImage.status == "ready"
-                ).first()
-                
-                if ready_golden:
-                    logger.info(f"Found ready golden image {ready_golden.id}, creating template")
-                    await self.mark_golden_image_ready(ready_golden.id)
-                    
-                    # After creating template, re-check if it exists before proceeding
-                    template_exists = template_path.exists()
-                    template_has_files = template_exists and any(template_path.iterdir()) if template_exists else False
-                    logger.info(f"After template creation - exists: {template_exists}, has files: {template_has_files}")
-                    
-                    # If template still doesn't exist, something went wrong - don't create hot spares
-                    if not template_exists or not template_has_files:
-                        logger.error("Template creation failed or incomplete, cannot create hot spares")
-                        return
-                
-                # No golden image available, check if one is being created
-                creating_golden = db.query(GoldenImage).filter(
-                    GoldenImage.vm_type == "11",
-                    GoldenImage.status == "creating"
-                ).first()
-                
-                if creating_golden:
-                    logger.info(f"Golden image {creating_golden.id} is already being created, waiting for completion")
-                    return
+            # Check if there's a ready golden image we can use. Only the id is read, and the
+            # session is closed before the template build, which can stop a container for
+            # VM_STOP_TIMEOUT; no pooled connection sits idle in a transaction meanwhile
+            async with SessionLocal() as db:
+                ready_golden_id = await db.scalar(
+                    select(GoldenImage.id).where(
+                        GoldenImage.vm_type == "11",
+                        GoldenImage.status == "ready"
+                    ).limit(1)
+                )
+            
+            # Building a template moves the golden image files into it, so a ready golden
+            # image without its directory has nothing left to build from
+            if ready_golden_id and (self._golden_root / str(ready_golden_id)).exists():
+                logger.info(f"Found ready golden image {ready_golden_id}, creating template")
+                await self.mark_golden_image_ready(str(ready_golden_id))
                 
-                # No golden image exists, create one
-                logger.info("No golden image template or ready golden image found, starting golden image creation")
-                await self.create_golden_image("11")
-                return
+                # After creating template, re-check if it exists before proceeding
+                template_has_files = _has_files(template_path)
+                logger.info(f"After template creation - has files: {template_has_files}")
                 
-            finally:
-                db.close()
+                # If template still doesn't exist, something went wrong - don't create hot spares
+                if not template_has_files:
+                    logger.error("Template creation failed or incomplete, cannot create hot spares")
+                    return []
+            elif ready_golden_id:
+                logger.warning(f"Golden image {ready_golden_id} is ready but its files are gone")
+            
+            # No golden image available, check if one is being created
+            async with SessionLocal() as db:
+                creating_golden_id = await db.scalar(
+                    select(GoldenImage.id).where(
+                        GoldenImage.vm_type == "11",
+                        GoldenImage.status == "creating"
+                    ).limit(1)
+                )
+            
+            if creating_golden_id:
+                logger.info(f"Golden image {creating_golden_id} is already being created, waiting for completion")
+                return []
+            
+            # No golden image exists, create one
+            logger.info("No golden image template or ready golden image found, starting golden image creation")
+            await self.create_golden_image("11")
+            return []
         
-        db = SessionLocal()
-        try:
-            current_count = db.query(VMInstance).filter(
-                VMInstance.is_hot_spare == True,
-                VMInstance.status == "ready",
-                VMInstance.assigned_to.is_(None)
-            ).count()
+        async with SessionLocal() as db:
+            # Spares still booting count too, or every call during a boot would start more;
+            # one that never reported ready within SPARE_BOOT_TIMEOUT is no longer counted
+            boot_cutoff = datetime.now(timezone.utc) - timedelta(seconds=SPARE_BOOT_TIMEOUT)
+            current_count = await db.scalar(
+                select(func.count()).select_from(VMInstance).where(
+                    VMInstance.is_hot_spare == True,
+                    or_(
+                        VMInstance.status == VMStatus.READY,
+                        and_(VMInstance.status == VMStatus.STARTING, VMInstance.created_at > boot_cutoff)
+                    ),
+                    VMInstance.assigned_to.is_(None)
+                )
+            )
             
             needed = settings.HOT_SPARE_COUNT - current_count
             logger.info(f"Current hot spares: {current_count}, needed: {needed}")
+            if needed <= 0:
+                return []
             
-            for i in range(needed):
-                try:
-                    logger.info(f"Creating hot spare {i + 1} of {needed}")
-                    await self.create_vm_instance(is_hot_spare=True)
-                    # Add delay between hot spare creation to prevent port conflicts
-                    if i < needed - 1:  # Don't wait after the last one
-                        await asyncio.sleep(2)
-                except Exception as e:
-                    logger.error(f"Error creating hot spare {i + 1}: {e}")
-                    break
-        finally:
-            db.close()
-    
-    async def list_vms(self) -> List[Dict[str, Any]]:
-        """List all VM instances"""
-        db = SessionLocal()
-        try:
-            vms = db.query(VMInstance).all()
-            return [
-                {
-                    "instance_id": vm.id,
-                    "container_id": vm.container_id,
-                    "vm_type": vm.vm_type,
-                    "status": vm.status,
-                    "port": vm.port,
-                    "is_hot_spare": vm.is_hot_spare,
-                    "assigned_to": vm.assigned_to,
-                    "created_at": vm.created_at.isoformat() if vm.created_at else None
-                }
-                for vm in vms
+            spares = [
+                VMInstance(id=uuid.uuid4(), vm_type=settings.VM_TYPE, status=VMStatus.STARTING, is_hot_spare=True)
+                for _ in range(needed)
             ]
-        finally:
-            db.close()
+            db.add_all(spares)
+            await db.commit()
+            return [spare.id for spare in spares]
+    
+    async def list_vms(self, limit: int = LIST_PAGE_SIZE, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        List VM instances, newest first, one page at a time
+        
+        Ids and timestamps are left as UUID and datetime objects for orjson to encode.
+        """
+        # Plain rows of just the listed columns; no ORM instances to build and track.
+        # The id tiebreak keeps pages stable when rows share a created_at
+        query = (
+            select(*_LIST_COLUMNS)
+            .order_by(VMInstance.created_at.desc(), VMInstance.id)
+            .limit(limit)
+            .offset(offset)
+        )
+        async with SessionLocal() as db:
+            rows = (await db.execute(query)).mappings().all()
+        return [dict(row) for row in rows]
     
-    async def _wait_for_container_ready(self, container_id: str, max_wait: int = 60):
-        """Wait for container to start - qemu/kvm will automatically create .mac files"""
+    async def _wait_for_container_ready(self, container_id: str, max_wait: int = 60) -> Optional[str]:
+        """
+        Wait for container to start - qemu/kvm will automatically create .mac files
+        
+        Returns:
+            Optional[str]: Docker's last reported status; "running" once started, one of
+            STOPPED_STATES if the container died while starting
+        """
         logger.info(f"Waiting for container {container_id} to start...")
         
-        for _ in range(max_wait):
-            try:
-                # Check if container is running and responsive
-                cmd = ["docker", "exec", container_id, "echo", "ready"]
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-                
-                if result.returncode == 0:
-                    logger.info(f"Container {container_id} is ready - qemu/kvm will create .mac file automatically")
-                    return True
-                    
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-                # Container not ready yet, wait a bit
-                await asyncio.sleep(1)
-                continue
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait
+        state = None
+        while loop.time() < deadline:
+            # One inspect per poll; no exec process is started inside the container
+            state = await asyncio.to_thread(self._container_state, container_id)
+            if state == "running":
+                logger.info(f"Container {container_id} is ready")
+                return state
+            if state in STOPPED_STATES:
+                logger.warning(f"Container {container_id} stopped while starting")
+                return state
+            
+            # Container not ready yet, wait a bit
+            await asyncio.sleep(CONTAINER_POLL_INTERVAL)
                 
         logger.warning(f"Container {container_id} not ready after {max_wait} seconds")
-        return False
\ No newline at end of file
+        return state
+    
+    def _container_state(self, container_id: str) -> Optional[str]:
+        """Docker's status for the container, or None if it can't be inspected; blocking"""
+        try:
+            return self.docker_client.api.inspect_container(container_id)["State"]["Status"]
+        except docker.errors.DockerException:
+            return None